@@ -1,8 +1,7 @@
 from flask import Flask, request, abort
-import json
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+from jwks import JWKSCache
 
 
 app = Flask(__name__)
@@ -11,6 +10,8 @@ AUTH0_DOMAIN = @TODO_REPLACE_WITH_YOUR_DOMAIN
 ALGORITHMS = ['RS256']
 API_AUDIENCE = @TODO_REPLACE_WITH_YOUR_API_AUDIENCE
 
+jwks_cache = JWKSCache(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json', algorithm=ALGORITHMS[0])
+
 
 class AuthError(Exception):
     def __init__(self, error, status_code):
@@ -52,25 +53,20 @@ def get_token_auth_header():
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        rsa_key = jwks_cache.get_key(unverified_header['kid'])
+    except Exception:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+class JWKSCache:
+    """Caches the signing keys of a JWKS endpoint, indexed by kid
+
+    Keys are kept as JWK dicts, the form jwt.decode accepts in every
+    python-jose version (python-jose-cryptodome 1.3.2 rejects key objects).
+    Once ttl seconds old they are refetched on the next lookup, and within
+    refresh_margin of that they are refreshed in a background thread, so
+    requests don't wait on the identity provider. An unknown kid (key
+    rotation) triggers a refetch at most every min_refetch_interval seconds.
+    When a refetch fails the previously fetched keys keep being served, and
+    the next attempt waits min_refetch_interval seconds.
+    """
+
+    def __init__(self, url, algorithm='RS256', ttl=600, refresh_margin=60,
+                 min_refetch_interval=30, timeout=5):
+        self.url = url
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+
+        self.keys = {}
+        self.fetched_at = None
+        self.attempted_at = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def fetch(self):
+        """Downloads the JWKS and replaces the cached keys
+        """
+        self.attempted_at = time.monotonic()
+        with urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read())
+
+        self.keys = {
+            key['kid']: key
+            for key in jwks['keys']
+            if 'kid' in key and key.get('kty') == 'RSA' and key.get('alg', self.algorithm) == self.algorithm
+        }
+        self.fetched_at = time.monotonic()
+
+    def refresh(self, last_attempt):
+        with self.lock:
+            # Another thread already refetched while this one was waiting.
+            if self.attempted_at != last_attempt:
+                self.refreshing = False
+                return
+            try:
+                self.fetch()
+            except Exception:
+                if not self.keys:
+                    raise
+            finally:
+                self.refreshing = False
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.refresh, args=(self.attempted_at,), daemon=True).start()
+
+    def get_key(self, kid):
+        """Returns the JWK dict for kid, None if the JWKS doesn't have it
+        """
+        now = time.monotonic()
+        may_refetch = self.attempted_at is None or now - self.attempted_at >= self.min_refetch_interval
+        if self.fetched_at is None or (now - self.fetched_at >= self.ttl and may_refetch):
+            self.refresh(self.attempted_at)
+        elif now - self.fetched_at >= self.ttl - self.refresh_margin and may_refetch:
+            self.refresh_in_background()
+
+        key = self.keys.get(kid)
+        if key is None and time.monotonic() - self.attempted_at >= self.min_refetch_interval:
+            self.refresh(self.attempted_at)
+            key = self.keys.get(kid)
+
+        return key
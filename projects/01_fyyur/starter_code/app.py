@@ -2,19 +2,28 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import os
+import csv
 import json
+import time
+import functools
+import click
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, stream_with_context, session
+from werkzeug.datastructures import MultiDict
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.ext.associationproxy import association_proxy
 from flask_migrate import Migrate
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from datetime import datetime
+from db_config import pool_metrics_text
+from page_cache import PageCache, LRUTier, SharedTier
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -26,12 +35,22 @@ app.config.from_object('config')
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
+shared_page_cache = None
+if app.config['PAGE_CACHE_REDIS_URL']:
+  import redis
+  shared_page_cache = SharedTier(redis.Redis.from_url(app.config['PAGE_CACHE_REDIS_URL']), app.config['PAGE_CACHE_TTL'])
+page_cache = PageCache(LRUTier(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL']), shared_page_cache)
+
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+      # Trigram GIN index so ILIKE '%term%' name searches don't scan the table on Postgres.
+      db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -43,13 +62,15 @@ class Venue(db.Model):
     facebook_link = db.Column(db.String(120), nullable=True)
 
     # Missing fields
-    genres = db.Column(db.String, nullable=False)
     website = db.Column(db.String(70), nullable=True)
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String, nullable=True)
 
     # Relationships
     shows = db.relationship('Show', backref=db.backref('venue', lazy=True))
+    genre_rows = db.relationship('VenueGenre', cascade='all, delete-orphan', order_by='VenueGenre.genre')
+    # List of genre names, stored one row per genre in VenueGenre.
+    genres = association_proxy('genre_rows', 'genre', creator=lambda genre: VenueGenre(genre=genre))
     
     #Internal Properties (Not columns inside DB).
     @hybrid_property
@@ -60,6 +81,12 @@ class Venue(db.Model):
     def upcoming_shows_count(self):
       return self.upcoming_shows.count()
 
+    @upcoming_shows_count.expression
+    def upcoming_shows_count(cls):
+      return db.select([db.func.count(Show.id)]) \
+        .where(db.and_(Show.venue_id == cls.id, Show.start_time>datetime.utcnow())) \
+        .label('upcoming_shows_count')
+
     @hybrid_property
     def past_shows(self):
       return Show.query.join('artist').filter(Show.venue_id == self.id, Show.start_time<=datetime.utcnow())
@@ -68,15 +95,24 @@ class Venue(db.Model):
     def past_shows_count(self):
       return self.past_shows.count()
 
+    @past_shows_count.expression
+    def past_shows_count(cls):
+      return db.select([db.func.count(Show.id)]) \
+        .where(db.and_(Show.venue_id == cls.id, Show.start_time<=datetime.utcnow())) \
+        .label('past_shows_count')
+
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+      # Trigram GIN index so ILIKE '%term%' name searches don't scan the table on Postgres.
+      db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.String(120), nullable=False)
     image_link = db.Column(db.String(500), nullable=True)
     facebook_link = db.Column(db.String(120), nullable=True)
 
@@ -87,6 +123,9 @@ class Artist(db.Model):
 
     #relationships
     shows = db.relationship('Show', backref=db.backref('artist', lazy=True))
+    genre_rows = db.relationship('ArtistGenre', cascade='all, delete-orphan', order_by='ArtistGenre.genre')
+    # List of genre names, stored one row per genre in ArtistGenre.
+    genres = association_proxy('genre_rows', 'genre', creator=lambda genre: ArtistGenre(genre=genre))
 
     #Properties (Not columns inside DB).
     @hybrid_property
@@ -97,6 +136,12 @@ class Artist(db.Model):
     def upcoming_shows_count(self):
       return self.upcoming_shows.count()
 
+    @upcoming_shows_count.expression
+    def upcoming_shows_count(cls):
+      return db.select([db.func.count(Show.id)]) \
+        .where(db.and_(Show.artist_id == cls.id, Show.start_time>datetime.utcnow())) \
+        .label('upcoming_shows_count')
+
     @hybrid_property
     def past_shows(self):
       return Show.query.join('venue').filter(Show.artist_id == self.id, Show.start_time<=datetime.utcnow())
@@ -105,29 +150,306 @@ class Artist(db.Model):
     def past_shows_count(self):
       return self.past_shows.count()
 
+    @past_shows_count.expression
+    def past_shows_count(cls):
+      return db.select([db.func.count(Show.id)]) \
+        .where(db.and_(Show.artist_id == cls.id, Show.start_time<=datetime.utcnow())) \
+        .label('past_shows_count')
+
 class Show(db.Model):
   __tablename__ = 'Show'
+  __table_args__ = (
+    # Serve the upcoming/past show filters of a venue or artist without scanning the table.
+    db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
   venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=True)
   start_time = db.Column(db.DateTime, nullable=False)
 
+class VenueGenre(db.Model):
+  __tablename__ = 'VenueGenre'
+  __table_args__ = (
+    # Answers genre filters ("all Jazz venues") from the index.
+    db.Index('ix_VenueGenre_genre', 'genre', 'venue_id'),
+  )
+
+  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+  genre = db.Column(db.String(120), primary_key=True)
+
+class ArtistGenre(db.Model):
+  __tablename__ = 'ArtistGenre'
+  __table_args__ = (
+    db.Index('ix_ArtistGenre_genre', 'genre', 'artist_id'),
+  )
+
+  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+  genre = db.Column(db.String(120), primary_key=True)
+
+class VenueArea(db.Model):
+  # Materialised /venues listing, one row per venue, kept up to date by
+  # refresh_venue_areas() (see the venue and show controllers).
+  __tablename__ = 'VenueArea'
+  __table_args__ = (
+    db.Index('ix_VenueArea_state_city', 'state', 'city', 'venue_id'),
+    db.Index('ix_VenueArea_next_show_time', 'next_show_time'),
+  )
+
+  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+  city = db.Column(db.String(120), nullable=False)
+  state = db.Column(db.String(120), nullable=False)
+  name = db.Column(db.String, nullable=False)
+  num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0)
+  # Start of the next upcoming show, when it becomes past the count is stale.
+  next_show_time = db.Column(db.DateTime, nullable=True)
+
+class ImportProgress(db.Model):
+  # Line reached by the import of a file, committed with the rows it covers.
+  __tablename__ = 'ImportProgress'
+
+  data_set = db.Column(db.String(120), primary_key=True)
+  path = db.Column(db.String(500), primary_key=True)
+  last_line = db.Column(db.Integer, nullable=False)
+
+class ImportedId(db.Model):
+  # Source id of every imported venue and artist, mapped to its new id.
+  __tablename__ = 'ImportedId'
+
+  data_set = db.Column(db.String(120), primary_key=True)
+  kind = db.Column(db.String(20), primary_key=True)
+  source_id = db.Column(db.String(120), primary_key=True)
+  new_id = db.Column(db.Integer, nullable=False)
+
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def get_venue_areas(genre=None):
+  # Read from the materialised VenueArea rows, in the listing order.
+  query = db.session.query(
+      VenueArea.city,
+      VenueArea.state,
+      VenueArea.venue_id,
+      VenueArea.name,
+      VenueArea.num_upcoming_shows
+    )
+  if genre:
+    query = query.join(VenueGenre, db.and_(VenueGenre.venue_id == VenueArea.venue_id, VenueGenre.genre == genre))
+  rows = query.order_by(VenueArea.state, VenueArea.city, VenueArea.venue_id).all()
+
+  areas = {}
+  for city, state, venue_id, name, num_upcoming_shows in rows:
+    areas.setdefault((city, state), []).append({
+      'id': venue_id,
+      'name': name,
+      'num_upcoming_shows': num_upcoming_shows
+    })
+
+  return [{
+    'city': city,
+    'state': state,
+    'venues': venues
+  } for (city, state), venues in areas.items()]
+
+def refresh_venue_areas(venue_ids=None):
+  # Recomputes the VenueArea rows of the given venues (all venues when None) with
+  # one grouped statement, in the caller's transaction. Ids of deleted venues
+  # just lose their row.
+  now = datetime.utcnow()
+  query = db.session.query(
+      Venue.id,
+      Venue.city,
+      Venue.state,
+      Venue.name,
+      db.func.count(Show.id),
+      db.func.min(Show.start_time)
+    ).outerjoin(Show, db.and_(Show.venue_id == Venue.id, Show.start_time > now)) \
+    .group_by(Venue.id, Venue.city, Venue.state, Venue.name)
+  stale = VenueArea.query
+  if venue_ids is not None:
+    venue_ids = [venue_id for venue_id in venue_ids if venue_id is not None]
+    if not venue_ids:
+      return 0
+    query = query.filter(Venue.id.in_(venue_ids))
+    stale = stale.filter(VenueArea.venue_id.in_(venue_ids))
+
+  rows = [{
+    'venue_id': venue_id,
+    'city': city,
+    'state': state,
+    'name': name,
+    'num_upcoming_shows': num_upcoming_shows,
+    'next_show_time': next_show_time
+  } for venue_id, city, state, name, num_upcoming_shows, next_show_time in query]
+
+  stale.delete(synchronize_session=False)
+  db.session.bulk_insert_mappings(VenueArea, rows)
+  return len(rows)
+
+def refresh_past_venue_areas():
+  # Refreshes the venues whose next upcoming show has started since their
+  # row was computed, for the periodic refresh-venue-areas command.
+  venue_ids = [venue_id for venue_id, in db.session.query(VenueArea.venue_id)
+    .filter(VenueArea.next_show_time <= datetime.utcnow())]
+  return refresh_venue_areas(venue_ids)
+
+def search_by_name(model, search_term):
+  # Served by the trigram index on Postgres and ranked by similarity to the term;
+  # other databases (SQLite in tests) keep plain ILIKE matching ordered by name.
+  query = model.query.filter(model.name.ilike(f'%{search_term}%'))
+  if db.engine.dialect.name == 'postgresql':
+    query = query.order_by(db.func.similarity(model.name, search_term).desc(), model.id)
+  else:
+    query = query.order_by(model.name, model.id)
+
+  return query.all()
+
+def split_shows(shows, counterpart):
+  # Partitions already loaded shows against a single utcnow() snapshot, flattening
+  # the eager-loaded counterpart (show.artist or show.venue) for the show tiles.
+  now = datetime.utcnow()
+  past_shows = []
+  upcoming_shows = []
+  for show in sorted(shows, key=lambda show: show.start_time):
+    other = getattr(show, counterpart)
+    if other is None:
+      continue
+    tile = {
+      counterpart + '_id': other.id,
+      counterpart + '_name': other.name,
+      counterpart + '_image_link': other.image_link,
+      'start_time': show.start_time
+    }
+    if show.start_time > now:
+      upcoming_shows.append(tile)
+    else:
+      past_shows.append(tile)
+
+  return {
+    'past_shows': past_shows,
+    'upcoming_shows': upcoming_shows,
+    'past_shows_count': len(past_shows),
+    'upcoming_shows_count': len(upcoming_shows)
+  }
+
+def get_venue_details(venue_id):
+  venue = Venue.query.options(
+      db.joinedload(Venue.shows).joinedload(Show.artist),
+      # a second query, joining the genres next to the shows would multiply the rows
+      db.selectinload(Venue.genre_rows)
+    ).get(venue_id)
+  if venue is None:
+    return None
+
+  data = {column.name: getattr(venue, column.name) for column in Venue.__table__.columns}
+  data['genres'] = list(venue.genres)
+  data.update(split_shows(venue.shows, 'artist'))
+  return data
+
+def get_artist_details(artist_id):
+  artist = Artist.query.options(
+      db.joinedload(Artist.shows).joinedload(Show.venue),
+      # a second query, joining the genres next to the shows would multiply the rows
+      db.selectinload(Artist.genre_rows)
+    ).get(artist_id)
+  if artist is None:
+    return None
+
+  data = {column.name: getattr(artist, column.name) for column in Artist.__table__.columns}
+  data['genres'] = list(artist.genres)
+  data.update(split_shows(artist.shows, 'venue'))
+  return data
+
+def get_shows(after=None):
+  # Only the venue/artist columns the listing renders are loaded, in the same
+  # SELECT as the shows, ordered by the (start_time, id) keyset.
+  query = Show.query.join(Show.artist).outerjoin(Show.venue).options(
+      db.contains_eager(Show.artist).load_only('name', 'image_link'),
+      db.contains_eager(Show.venue).load_only('name')
+    ).order_by(Show.start_time, Show.id)
+
+  if after is not None:
+    start_time, show_id = after
+    query = query.filter(db.or_(
+      Show.start_time > start_time,
+      db.and_(Show.start_time == start_time, Show.id > show_id)
+    ))
+
+  return query
+
+def parse_shows_cursor(cursor):
+  start_time, show_id = cursor.rsplit('_', 1)
+  return datetime.fromisoformat(start_time), int(show_id)
+
+def format_shows_cursor(show):
+  return show.start_time.isoformat() + '_' + str(show.id)
+
+def format_show(show):
+  return {
+    'venue_id': show.venue_id,
+    'venue_name': show.venue.name if show.venue else 'Removed/Unknown venue',
+    'artist_id': show.artist_id,
+    'artist_name': show.artist.name,
+    'artist_image_link': show.artist.image_link,
+    'start_time': show.start_time
+  }
+
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+@functools.lru_cache(maxsize=64)
+def get_datetime_pattern(format, locale):
+  # Babel pattern and locale, parsed once per format/locale instead of per call.
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+def format_datetime(value, format='medium', locale=babel.dates.LC_TIME):
+  # Takes datetimes as they come from the models; strings are still parsed.
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  if format in ('long', 'short'):
+    return babel.dates.format_datetime(value, format, locale=locale)
+  pattern, locale = get_datetime_pattern(format, locale)
+  return pattern.apply(value, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+def stream_template(template_name, **context):
+  # Renders the template progressively, flushing every few chunks, so long
+  # listings start reaching the client before the whole page is built.
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(context)
+  stream.enable_buffering(5)
+  return stream
+
+def cached_page(entity, render, variant=''):
+  # Serves the page rendered by render() from the page cache. Pages with pending
+  # flash messages differ per visitor, they are rendered and not stored.
+  if '_flashes' in session:
+    return render()
+  key, page = page_cache.get(entity, variant)
+  if page is None:
+    page = render()
+    page_cache.set(key, page)
+  return page
+
+def venue_page_entities(venue):
+  # Cached pages showing the venue: its own, the listing and its artists' pages.
+  return ['venue:%d' % venue.id, 'venues'] + ['artist:%d' % show.artist_id for show in venue.shows]
+
+def artist_page_entities(artist):
+  return ['artist:%d' % artist.id, 'artists'] + ['venue:%d' % show.venue_id for show in artist.shows if show.venue_id]
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -142,33 +464,18 @@ def index():
 
 @app.route('/venues')
 def venues():
-  venues = Venue.query.all()
-  areas = {}
-  for venue in venues:
-    areas.setdefault(venue.city + '_' + venue.state, []).append({
-      'id': venue.id,
-      'name': venue.name,
-      'num_upcoming_shows': venue.upcoming_shows_count
-    })
-  
-  data = []
-
-  for area in areas:
-    address = area.split('_')
-    data.append({
-      'city': address[0],
-      'state': address[1],
-      'venues': areas[area]
-    })
-  return render_template('pages/venues.html', areas=data);
+  # ?genre=Jazz only lists the venues playing that genre.
+  genre = request.args.get('genre', '')
+  return cached_page('venues',
+    lambda: render_template('pages/venues.html', areas=get_venue_areas(genre)), genre)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   search_term = request.form['search_term']
-  found_venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%'))
+  found_venues = search_by_name(Venue, search_term)
   response = {
-    'count': found_venues.count(),
-    'data': found_venues.all()
+    'count': len(found_venues),
+    'data': found_venues
   }
   
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
@@ -176,8 +483,13 @@ def search_venues():
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  venue = Venue.query.get(venue_id)
-  return render_template('pages/show_venue.html', venue=venue)
+  def render():
+    venue = get_venue_details(venue_id)
+    if venue is None:
+      abort(404)
+    return render_template('pages/show_venue.html', venue=venue)
+
+  return cached_page('venue:%d' % venue_id, render)
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -198,14 +510,17 @@ def create_venue_submission():
     address = request.form['address']
     phone = request.form['phone']
     image_link = request.form['image_link']
-    genres = request.form['genres']
+    genres = request.form.getlist('genres')
     facebook_link = request.form['facebook_link']
 
     venue = Venue(name=name, city=city, state=state, address=address, phone=phone,
       image_link=image_link, genres=genres, facebook_link=facebook_link)
     
     db.session.add(venue)
+    db.session.flush()
+    refresh_venue_areas([venue.id])
     db.session.commit()
+    page_cache.invalidate('venues')
 
     nameFromDB = venue.name
   except:
@@ -225,9 +540,13 @@ def delete_venue(venue_id):
   resBody = { "location": "" }
   try:
     venue = Venue.query.get(venue_id)
+    stale_pages = venue_page_entities(venue)
     db.session.delete(venue)
+    db.session.flush()
+    refresh_venue_areas([venue.id])
 
     db.session.commit()
+    page_cache.invalidate(*stale_pages)
     print(venue)
     
     resBody['location'] = '/';
@@ -242,24 +561,36 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  artists = Artist.query.all()
-  return render_template('pages/artists.html', artists=artists)
+  # ?genre=Jazz only lists the artists playing that genre.
+  genre = request.args.get('genre', '')
+
+  def render():
+    query = Artist.query
+    if genre:
+      query = query.join(ArtistGenre, db.and_(ArtistGenre.artist_id == Artist.id, ArtistGenre.genre == genre))
+    return render_template('pages/artists.html', artists=query.all())
+
+  return cached_page('artists', render, genre)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   search_term = request.form['search_term']
-  artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%'))
+  artists = search_by_name(Artist, search_term)
   response = {
-    "count": artists.count(),
-    "data": artists.all()
+    "count": len(artists),
+    "data": artists
   }
   return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-  artist = Artist.query.get(artist_id)
+  def render():
+    artist = get_artist_details(artist_id)
+    if artist is None:
+      abort(404)
+    return render_template('pages/show_artist.html', artist=artist)
 
-  return render_template('pages/show_artist.html', artist=artist)
+  return cached_page('artist:%d' % artist_id, render)
 
 #  Update
 #  ----------------------------------------------------------------
@@ -274,14 +605,16 @@ def edit_artist(artist_id):
 def edit_artist_submission(artist_id):
   artist = Artist.query.get(artist_id)
   artist.name = request.form['name']
-  artist.genres = request.form['genres']
+  artist.genres = request.form.getlist('genres')
   artist.city = request.form['city']
   artist.state = request.form['state']
   artist.phone = request.form['phone']
   artist.facebook_link = request.form['facebook_link']
   artist.image_link = request.form['image_link']
+  stale_pages = artist_page_entities(artist)
 
   db.session.commit()
+  page_cache.invalidate(*stale_pages)
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
@@ -295,7 +628,7 @@ def edit_venue(venue_id):
 def edit_venue_submission(venue_id):
   venue = Venue.query.get(venue_id)
   venue.name = request.form['name']
-  venue.genres = request.form['genres']
+  venue.genres = request.form.getlist('genres')
   venue.address = request.form['address']
   venue.city = request.form['city']
   venue.state = request.form['state']
@@ -303,7 +636,11 @@ def edit_venue_submission(venue_id):
   venue.facebook_link = request.form['facebook_link']
   venue.image_link = request.form['image_link']
 
+  db.session.flush()
+  refresh_venue_areas([venue.id])
+  stale_pages = venue_page_entities(venue)
   db.session.commit()
+  page_cache.invalidate(*stale_pages)
 
   return redirect(url_for('show_venue', venue_id=venue_id))
 
@@ -325,13 +662,14 @@ def create_artist_submission():
     state = request.form['state']
     phone = request.form['phone']
     image_link = request.form['image_link']
-    genres = request.form['genres']
+    genres = request.form.getlist('genres')
     facebook_link = request.form['facebook_link']
     artist = Artist(name=name, city=city, state=state, phone=phone, image_link=image_link,
       genres=genres, facebook_link=facebook_link)
 
     db.session.add(artist)
     db.session.commit()
+    page_cache.invalidate('artists')
     nameFromDB = artist.name
   except:
     error = True
@@ -350,21 +688,26 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-  shows = Show.query.all()
-  data = []
-  for show in shows:
-    show_venue = show.venue;
-    show_artist = show.artist;
-    data.append({
-      'venue_id': show.venue_id,
-      'venue_name': show_venue.name if show_venue else 'Removed/Unknown venue',
-      'artist_id': show.artist_id,
-      'artist_name': show_artist.name,
-      'artist_image_link': show_artist.image_link,
-      'start_time': show.start_time
-    })
-  
-  return render_template('pages/shows.html', shows=data)
+  after = request.args.get('after')
+  try:
+    after = parse_shows_cursor(after) if after else None
+  except ValueError:
+    abort(400)
+  query = get_shows(after)
+
+  if request.args.get('stream'):
+    # Streams every show after the cursor, fetching rows in batches as they are rendered.
+    data = (format_show(show) for show in query.yield_per(app.config['SHOWS_PER_PAGE']))
+    return Response(stream_with_context(stream_template('pages/shows.html', shows=data)))
+
+  shows = query.limit(app.config['SHOWS_PER_PAGE'] + 1).all()
+  next_cursor = None
+  if len(shows) > app.config['SHOWS_PER_PAGE']:
+    shows = shows[:-1]
+    next_cursor = format_shows_cursor(shows[-1])
+  data = [format_show(show) for show in shows]
+
+  return render_template('pages/shows.html', shows=data, next_cursor=next_cursor)
 
 @app.route('/shows/create')
 def create_shows():
@@ -379,12 +722,15 @@ def create_show_submission():
   try:
     venue_id = request.form['venue_id']
     artist_id = request.form['artist_id']
-    start_time = request.form['start_time']
+    start_time = dateutil.parser.parse(request.form['start_time'])
     
     show = Show(venue_id=venue_id, artist_id=artist_id, start_time=start_time)
     
     db.session.add(show)
+    db.session.flush()
+    refresh_venue_areas([show.venue_id])
     db.session.commit()
+    page_cache.invalidate('venues', 'venue:%s' % venue_id, 'artist:%s' % artist_id)
   except:
     error = True
     db.session.rollback()
@@ -397,6 +743,15 @@ def create_show_submission():
 
   return render_template('pages/home.html')
 
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/metrics')
+def metrics():
+  # Database pool checkout wait time and page cache hits/misses of this process,
+  # in the Prometheus text format.
+  return Response(pool_metrics_text() + page_cache.metrics_text(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -416,6 +771,180 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+
+# kind: (form validating a row, model, genre model, genre foreign key)
+IMPORT_KINDS = {
+  'venues': (VenueForm, Venue, VenueGenre, 'venue_id'),
+  'artists': (ArtistForm, Artist, ArtistGenre, 'artist_id'),
+  'shows': (ShowForm, Show, None, None),
+}
+
+def read_import_rows(path):
+  # Streams (line number, row) from a CSV file with a header line or an NDJSON
+  # file. Rows that aren't valid JSON come out as None.
+  with open(path, newline='') as file:
+    if path.lower().endswith('.csv'):
+      for number, row in enumerate(csv.DictReader(file), 2):
+        yield number, row
+    else:
+      for number, line in enumerate(file, 1):
+        if not line.strip():
+          continue
+        try:
+          yield number, json.loads(line)
+        except ValueError:
+          yield number, None
+
+def import_formdata(row):
+  # CSV genres come as one comma separated cell, NDJSON genres as a list.
+  formdata = MultiDict()
+  for name, value in row.items():
+    if name == 'genres' and isinstance(value, str):
+      value = [genre.strip() for genre in value.split(',') if genre.strip()]
+    if isinstance(value, list):
+      formdata.setlist(name, [str(item) for item in value])
+    elif value is not None:
+      formdata[name] = str(value)
+  return formdata
+
+def insert_import_chunk(model, rows):
+  # One multi-row INSERT returning the new ids on Postgres; other databases
+  # (SQLite in tests) insert the rows one by one in the same transaction.
+  table = model.__table__
+  if db.engine.dialect.name == 'postgresql':
+    return [row_id for row_id, in db.session.execute(table.insert().values(rows).returning(table.c.id))]
+  return [db.session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+def load_imported_ids(data_set, kind):
+  query = db.session.query(ImportedId.source_id, ImportedId.new_id) \
+    .filter(ImportedId.data_set == data_set, ImportedId.kind == kind)
+  return dict(query)
+
+def import_rows(kind, path, data_set='default', chunk_size=1000, log=print):
+  # Validates every row with the form of its kind and inserts the valid ones in
+  # chunks of chunk_size rows, one transaction per chunk. Source ids of venues
+  # and artists are mapped to the new ids, shows reference venues and artists by
+  # their source ids. The line reached and the id map are written in the
+  # transaction of every chunk, so an interrupted import resumes where it
+  # stopped without importing a row twice.
+  form_class, model, genre_model, genre_key = IMPORT_KINDS[kind]
+  file_key = os.path.abspath(path)
+  progress = ImportProgress.query.get((data_set, file_key))
+  done = progress.last_line if progress is not None else 0
+  ids = {id_kind: load_imported_ids(data_set, id_kind) for id_kind in ('venues', 'artists')}
+  stats = {'imported': 0, 'rejected': 0}
+  started = time.perf_counter()
+  chunk = []
+  chunk_source_ids = set()
+
+  def flush(last_line):
+    stale_pages = []
+    new_source_ids = {}
+    if chunk:
+      new_ids = insert_import_chunk(model, [values for _, values, _ in chunk])
+      stale_pages.append(kind)
+      if genre_model is not None:
+        genre_rows = [{genre_key: new_id, 'genre': genre}
+          for new_id, (_, _, genres) in zip(new_ids, chunk) for genre in genres]
+        if genre_rows:
+          db.session.execute(genre_model.__table__.insert(), genre_rows)
+        new_source_ids = {source_id: new_id
+          for new_id, (source_id, _, _) in zip(new_ids, chunk) if source_id is not None}
+        if new_source_ids:
+          db.session.execute(ImportedId.__table__.insert(), [
+            {'data_set': data_set, 'kind': kind, 'source_id': source_id, 'new_id': new_id}
+            for source_id, new_id in new_source_ids.items()])
+      if kind == 'venues':
+        refresh_venue_areas(new_ids)
+      if kind == 'shows':
+        venue_ids = set(values['venue_id'] for _, values, _ in chunk)
+        refresh_venue_areas(venue_ids)
+        stale_pages += ['venues'] + ['venue:%d' % venue_id for venue_id in venue_ids] + \
+          ['artist:%d' % values['artist_id'] for _, values, _ in chunk]
+
+    db.session.merge(ImportProgress(data_set=data_set, path=file_key, last_line=last_line))
+    db.session.commit()
+    if new_source_ids:
+      ids[kind].update(new_source_ids)
+    if stale_pages:
+      page_cache.invalidate(*stale_pages)
+    stats['imported'] += len(chunk)
+    chunk.clear()
+    chunk_source_ids.clear()
+
+    elapsed = time.perf_counter() - started
+    log('{}: {} imported, {} rejected, {:.0f} rows/s'.format(
+      kind, stats['imported'], stats['rejected'], stats['imported'] / elapsed if elapsed else 0))
+
+  line = done
+  for line, row in read_import_rows(path):
+    if line <= done:
+      continue
+    if not isinstance(row, dict):
+      stats['rejected'] += 1
+      log('line {}: not a valid row'.format(line))
+      continue
+
+    form = form_class(formdata=import_formdata(row), meta={'csrf': False})
+    errors = {} if form.validate() else dict(form.errors)
+    source_id = str(row['id']) if row.get('id') not in (None, '') else None
+
+    if kind != 'shows' and source_id is not None and (source_id in ids[kind] or source_id in chunk_source_ids):
+      errors['id'] = ['Already imported.']
+    if kind == 'shows' and not errors:
+      venue_id = ids['venues'].get(form.venue_id.data)
+      artist_id = ids['artists'].get(form.artist_id.data)
+      if venue_id is None:
+        errors['venue_id'] = ['Unknown venue.']
+      if artist_id is None:
+        errors['artist_id'] = ['Unknown artist.']
+    if errors:
+      stats['rejected'] += 1
+      log('line {}: {}'.format(line, errors))
+      continue
+
+    if kind == 'shows':
+      values = {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': form.start_time.data}
+      genres = []
+    else:
+      values = {field.name: field.data for field in form if field.name not in ('genres', 'csrf_token')}
+      genres = list(dict.fromkeys(form.genres.data))
+    chunk.append((source_id, values, genres))
+    chunk_source_ids.add(source_id)
+    if len(chunk) >= chunk_size:
+      flush(line)
+
+  flush(line)
+  return stats
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('refresh-venue-areas')
+@click.option('--all', 'refresh_all', is_flag=True, help='Rebuild the rows of every venue.')
+def refresh_venue_areas_command(refresh_all):
+  # Run periodically (e.g. every minute from cron) so venues whose upcoming
+  # shows started move them to past in the /venues counts.
+  refreshed = refresh_venue_areas() if refresh_all else refresh_past_venue_areas()
+  db.session.commit()
+  page_cache.invalidate('venues')
+  click.echo('Refreshed {} venue areas.'.format(refreshed))
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(list(IMPORT_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--data-set', default='default', show_default=True,
+  help='Name of the data set, its imports share the progress and the id map.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows inserted per transaction.')
+def import_data_command(kind, path, data_set, chunk_size):
+  # Import venues, then artists, then shows (CSV or NDJSON); rerun the same
+  # command to resume an interrupted import.
+  import_rows(kind, path, data_set, chunk_size, log=click.echo)
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,32 @@
+"""add (venue_id, start_time) and (artist_id, start_time) indexes on Show
+
+Revision ID: 7d2e5b8c4f1a
+Revises: 3a1f9c2d7b4e
+Create Date: 2026-10-18 14:05:47.218903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e5b8c4f1a'
+down_revision = '3a1f9c2d7b4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CONCURRENTLY can't run inside a transaction, and builds the indexes
+    # without blocking writes to the Show table.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False,
+            postgresql_concurrently=True)
+        op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False,
+            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_Show_artist_id_start_time', table_name='Show', postgresql_concurrently=True)
+        op.drop_index('ix_Show_venue_id_start_time', table_name='Show', postgresql_concurrently=True)
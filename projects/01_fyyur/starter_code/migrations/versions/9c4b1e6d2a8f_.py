@@ -0,0 +1,76 @@
+"""move venue and artist genres to indexed VenueGenre and ArtistGenre tables
+
+Revision ID: 9c4b1e6d2a8f
+Revises: 7d2e5b8c4f1a
+Create Date: 2026-10-18 15:32:09.614275
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4b1e6d2a8f'
+down_revision = '7d2e5b8c4f1a'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# (owner table, genre table, foreign key column)
+GENRE_TABLES = (
+    ('Venue', 'VenueGenre', 'venue_id'),
+    ('Artist', 'ArtistGenre', 'artist_id'),
+)
+
+
+def upgrade():
+    for owner, table, fk in GENRE_TABLES:
+        op.create_table(table,
+        sa.Column(fk, sa.Integer(), nullable=False),
+        sa.Column('genre', sa.String(length=120), nullable=False),
+        sa.ForeignKeyConstraint([fk], [owner + '.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(fk, 'genre')
+        )
+        op.create_index('ix_{}_genre'.format(table), table, ['genre', fk], unique=False)
+
+    # Backfill in batches of BATCH_SIZE owners, each one statement committed on
+    # its own, so the owner tables are never locked for the whole copy. The free
+    # form column holds a single genre, a comma separated list or an array
+    # literal like {Jazz,"Rock n Roll"}.
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        for owner, table, fk in GENRE_TABLES:
+            last_id = 0
+            while True:
+                batch_end = connection.execute(sa.text(
+                    'SELECT max(id) FROM (SELECT id FROM "{}" WHERE id > :last_id ORDER BY id LIMIT :limit) AS batch'
+                    .format(owner)), last_id=last_id, limit=BATCH_SIZE).scalar()
+                if batch_end is None:
+                    break
+                connection.execute(sa.text(
+                    'INSERT INTO "{table}" ({fk}, genre) '
+                    'SELECT DISTINCT id, btrim(genre, \' "\'\'\') FROM "{owner}", '
+                    'regexp_split_to_table(btrim(genres, \'{{}}[]\'), \',\') AS genre '
+                    'WHERE id > :last_id AND id <= :batch_end AND btrim(genre, \' "\'\'\') <> \'\' '
+                    'ON CONFLICT DO NOTHING'.format(owner=owner, table=table, fk=fk)),
+                    last_id=last_id, batch_end=batch_end)
+                last_id = batch_end
+
+    op.drop_column('Venue', 'genres')
+    op.drop_column('Artist', 'genres')
+
+
+def downgrade():
+    op.add_column('Venue', sa.Column('genres', sa.String(), nullable=True))
+    op.add_column('Artist', sa.Column('genres', sa.String(length=120), nullable=True))
+
+    for owner, table, fk in GENRE_TABLES:
+        op.execute(
+            'UPDATE "{owner}" SET genres = ('
+            'SELECT string_agg(genre, \',\' ORDER BY genre) FROM "{table}" WHERE "{table}".{fk} = "{owner}".id'
+            ')'.format(owner=owner, table=table, fk=fk))
+        op.execute('UPDATE "{}" SET genres = \'\' WHERE genres IS NULL'.format(owner))
+        op.alter_column(owner, 'genres', nullable=False)
+        op.drop_index('ix_{}_genre'.format(table), table_name=table)
+        op.drop_table(table)
@@ -0,0 +1,45 @@
+"""add the materialised VenueArea listing
+
+Revision ID: a5e8d3f1c7b2
+Revises: 9c4b1e6d2a8f
+Create Date: 2026-10-18 16:48:22.903561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5e8d3f1c7b2'
+down_revision = '9c4b1e6d2a8f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('VenueArea',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('city', sa.String(length=120), nullable=False),
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('num_upcoming_shows', sa.Integer(), nullable=False),
+    sa.Column('next_show_time', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id')
+    )
+    op.create_index('ix_VenueArea_state_city', 'VenueArea', ['state', 'city', 'venue_id'], unique=False)
+    op.create_index('ix_VenueArea_next_show_time', 'VenueArea', ['next_show_time'], unique=False)
+
+    # Initial rows, the app keeps them up to date from here on.
+    op.execute(
+        'INSERT INTO "VenueArea" (venue_id, city, state, name, num_upcoming_shows, next_show_time) '
+        'SELECT "Venue".id, "Venue".city, "Venue".state, "Venue".name, count("Show".id), min("Show".start_time) '
+        'FROM "Venue" LEFT OUTER JOIN "Show" '
+        'ON "Show".venue_id = "Venue".id AND "Show".start_time > (now() AT TIME ZONE \'utc\') '
+        'GROUP BY "Venue".id, "Venue".city, "Venue".state, "Venue".name')
+
+
+def downgrade():
+    op.drop_index('ix_VenueArea_next_show_time', table_name='VenueArea')
+    op.drop_index('ix_VenueArea_state_city', table_name='VenueArea')
+    op.drop_table('VenueArea')
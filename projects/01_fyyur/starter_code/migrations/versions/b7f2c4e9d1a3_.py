@@ -0,0 +1,37 @@
+"""keep the import progress and id map in the database
+
+Revision ID: b7f2c4e9d1a3
+Revises: a5e8d3f1c7b2
+Create Date: 2026-10-18 18:12:40.517204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f2c4e9d1a3'
+down_revision = 'a5e8d3f1c7b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ImportProgress',
+    sa.Column('data_set', sa.String(length=120), nullable=False),
+    sa.Column('path', sa.String(length=500), nullable=False),
+    sa.Column('last_line', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('data_set', 'path')
+    )
+    op.create_table('ImportedId',
+    sa.Column('data_set', sa.String(length=120), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('source_id', sa.String(length=120), nullable=False),
+    sa.Column('new_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('data_set', 'kind', 'source_id')
+    )
+
+
+def downgrade():
+    op.drop_table('ImportedId')
+    op.drop_table('ImportProgress')
@@ -0,0 +1,194 @@
+import fnmatch
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTier:
+    """In-process tier: the max_entries most recently used pages
+
+    Entries older than ttl seconds are dropped on lookup.
+    """
+
+    name = 'local'
+
+    def __init__(self, max_entries=512, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_version(self, entity):
+        return self.versions.get(entity, 0)
+
+    def bump_version(self, entity):
+        with self.lock:
+            self.versions[entity] = self.versions.get(entity, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+
+class LocalStore:
+    """Stand-in for the shared store (the subset of the redis client API the
+    shared tier uses), for tests and single process deployments
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None or (entry[1] is not None and entry[1] <= time.monotonic()):
+                return None
+            return entry[0]
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.values[key] = (value, time.monotonic() + ex if ex else None)
+
+    def incr(self, key):
+        with self.lock:
+            value = int(self.values.get(key, (0, None))[0]) + 1
+            self.values[key] = (value, None)
+            return value
+
+    def scan_iter(self, match='*'):
+        with self.lock:
+            keys = [key for key in self.values if fnmatch.fnmatchcase(key, match)]
+        return iter(keys)
+
+    def delete(self, *keys):
+        with self.lock:
+            return sum(self.values.pop(key, None) is not None for key in keys)
+
+
+class SharedTier:
+    """Tier shared by every worker, in a redis-like store
+
+    The entity versions live in the store too, so an invalidation made by one
+    worker is seen by all of them.
+    """
+
+    name = 'shared'
+
+    def __init__(self, store, ttl=60, prefix='fyyur:page:'):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.store.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value):
+        self.store.set(self.prefix + key, value, ex=self.ttl)
+
+    def get_version(self, entity):
+        return int(self.store.get(self.prefix + 'version:' + entity) or 0)
+
+    def bump_version(self, entity):
+        self.store.incr(self.prefix + 'version:' + entity)
+
+    def clear(self):
+        # Only the keys of the page cache, the store may be shared with other data.
+        keys = list(self.store.scan_iter(self.prefix + '*'))
+        if keys:
+            self.store.delete(*keys)
+
+
+class PageCache:
+    """Rendered pages keyed by entity ('venue:3', 'venues', ...), the entity
+    version and a variant (e.g. the query string)
+
+    Lookups go through the local tier, then the shared tier when there is one.
+    invalidate() bumps the entity versions, so the cached pages of the entity
+    are never served again and age out of the tiers.
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.tiers = [tier for tier in (local, shared) if tier is not None]
+
+    def versions(self):
+        return self.shared or self.local
+
+    def key(self, entity, variant=''):
+        return '{}:{}:{}'.format(entity, self.versions().get_version(entity), variant)
+
+    def get(self, entity, variant=''):
+        """Returns (key, page), page is None on a miss
+
+        The key carries the entity version read before rendering, store the
+        rendered page under it with set(): a page rendered while the entity
+        was invalidated then goes under the old version and is never served.
+        """
+        key = self.key(entity, variant)
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return key, value
+
+    def set(self, key, value):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def invalidate(self, *entities):
+        for entity in set(entities):
+            self.versions().bump_version(entity)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def metrics_text(self):
+        """Hit/miss counters of every tier in the Prometheus text format
+        """
+        lines = [
+            '# HELP page_cache_hits_total Pages served from the page cache.',
+            '# TYPE page_cache_hits_total counter',
+        ]
+        lines += ['page_cache_hits_total{{tier="{}"}} {}'.format(tier.name, tier.hits) for tier in self.tiers]
+        lines += [
+            '# HELP page_cache_misses_total Page cache lookups that found nothing.',
+            '# TYPE page_cache_misses_total counter',
+        ]
+        lines += ['page_cache_misses_total{{tier="{}"}} {}'.format(tier.name, tier.misses) for tier in self.tiers]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,461 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+import babel.dates
+import dateutil.parser
+from sqlalchemy import event
+
+from app import app, db, Venue, Artist, Show, VenueGenre, VenueArea, get_venue_areas, refresh_venue_areas, \
+    format_datetime, page_cache, import_rows
+from page_cache import PageCache, LRUTier, SharedTier, LocalStore
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+        self.client = app.test_client
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        page_cache.clear()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    # Helpers
+    def seed_venues(self, count, city='San Francisco', state='CA'):
+        artist = Artist(name='Artist', city=city, state=state, phone='123-123-1234', genres=['Jazz'])
+        db.session.add(artist)
+        db.session.flush()
+        for i in range(count):
+            venue = Venue(name='Venue %d' % i, city=city, state=state, address='%d Street' % i,
+                phone='123-123-1234', genres=['Jazz'])
+            db.session.add(venue)
+            db.session.flush()
+            db.session.add(Show(venue_id=venue.id, artist_id=artist.id,
+                start_time=datetime.utcnow() + timedelta(days=1)))
+            db.session.add(Show(venue_id=venue.id, artist_id=artist.id,
+                start_time=datetime.utcnow() - timedelta(days=1)))
+        db.session.flush()
+        refresh_venue_areas()
+        db.session.commit()
+        # written without the controllers, which invalidate the cached pages
+        page_cache.clear()
+        return artist
+
+    def count_queries(self, fn):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            result = fn()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return len(statements), result
+
+    # Tests starting
+    def test_venues_query_count_is_constant(self):
+        self.seed_venues(5)
+        small_count, _ = self.count_queries(lambda: self.client().get('/venues'))
+
+        self.seed_venues(200, city='New York', state='NY')
+        large_count, response = self.count_queries(lambda: self.client().get('/venues'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(small_count, large_count)
+
+    def test_venue_areas_with_results(self):
+        self.seed_venues(2)
+        self.seed_venues(1, city='New York', state='NY')
+        db.session.add(Venue(name='Empty Venue', city='New York', state='NY', address='1 Street',
+            phone='123-123-1234', genres=['Jazz']))
+        db.session.flush()
+        refresh_venue_areas()
+        db.session.commit()
+
+        areas = {(area['city'], area['state']): area['venues'] for area in get_venue_areas()}
+
+        self.assertEqual(len(areas), 2)
+        self.assertEqual(len(areas[('San Francisco', 'CA')]), 2)
+        self.assertEqual([venue['num_upcoming_shows'] for venue in areas[('New York', 'NY')]], [1, 0])
+
+    def test_venue_areas_follow_controllers(self):
+        artist_id = self.seed_venues(1).id
+        venue_id = Venue.query.first().id
+
+        self.client().post('/venues/create', data={
+            'name': 'New Venue', 'genres': ['Jazz'], 'address': '1 Street', 'city': 'Austin',
+            'state': 'TX', 'phone': '123-123-1234', 'facebook_link': '', 'image_link': ''})
+        self.client().post('/shows/create', data={
+            'venue_id': venue_id, 'artist_id': artist_id,
+            'start_time': (datetime.utcnow() + timedelta(days=2)).isoformat(sep=' ')})
+        self.client().post('/venues/%d/edit' % venue_id, data={
+            'name': 'Renamed Venue', 'genres': ['Jazz'], 'address': '0 Street', 'city': 'San Francisco',
+            'state': 'CA', 'phone': '123-123-1234', 'facebook_link': '', 'image_link': ''})
+
+        areas = {(area['city'], area['state']): area['venues'] for area in get_venue_areas()}
+        self.assertEqual([venue['name'] for venue in areas[('Austin', 'TX')]], ['New Venue'])
+        self.assertEqual(areas[('San Francisco', 'CA')][0]['name'], 'Renamed Venue')
+        self.assertEqual(areas[('San Francisco', 'CA')][0]['num_upcoming_shows'], 2)
+
+        self.client().delete('/venues/%d' % venue_id)
+
+        self.assertNotIn(('San Francisco', 'CA'), [(area['city'], area['state']) for area in get_venue_areas()])
+
+    def test_refresh_venue_areas_command(self):
+        self.seed_venues(2)
+        # the upcoming show of the first venue started since the last refresh
+        venue_id = Venue.query.order_by(Venue.id).first().id
+        started = datetime.utcnow() - timedelta(minutes=1)
+        Show.query.filter(Show.venue_id == venue_id, Show.start_time > datetime.utcnow()) \
+            .update({'start_time': started}, synchronize_session=False)
+        VenueArea.query.filter(VenueArea.venue_id == venue_id) \
+            .update({'next_show_time': started}, synchronize_session=False)
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['refresh-venue-areas'])
+
+        self.assertIn('Refreshed 1 venue areas.', result.output)
+        self.assertEqual([venue['num_upcoming_shows'] for area in get_venue_areas() for venue in area['venues']], [0, 1])
+
+    def test_show_count_expressions(self):
+        artist = self.seed_venues(2)
+        db.session.add(Venue(name='Empty Venue', city='New York', state='NY', address='1 Street',
+            phone='123-123-1234', genres=['Jazz']))
+        db.session.commit()
+
+        venues = Venue.query.order_by(Venue.upcoming_shows_count.asc(), Venue.id).all()
+        busy_venues = Venue.query.filter(Venue.past_shows_count > 0).count()
+        counts = db.session.query(Artist.upcoming_shows_count, Artist.past_shows_count) \
+            .filter(Artist.id == artist.id).one()
+
+        self.assertEqual(venues[0].name, 'Empty Venue')
+        self.assertEqual(busy_venues, 2)
+        self.assertEqual(tuple(counts), (2, 2))
+
+    def test_detail_pages_query_count(self):
+        artist_id = self.seed_venues(3).id
+        venue_id = Venue.query.first().id
+        # as in a new request, nothing is loaded in the session yet
+        db.session.expunge_all()
+
+        venue_count, venue_response = self.count_queries(lambda: self.client().get('/venues/%d' % venue_id))
+        db.session.expunge_all()
+        artist_count, artist_response = self.count_queries(lambda: self.client().get('/artists/%d' % artist_id))
+
+        self.assertEqual(venue_response.status_code, 200)
+        self.assertEqual(artist_response.status_code, 200)
+        # the entity with its shows, then its genres
+        self.assertEqual(venue_count, 2)
+        self.assertEqual(artist_count, 2)
+        self.assertIn(b'3 Upcoming Shows', artist_response.data)
+        self.assertIn(b'1 Past Show<', venue_response.data)
+
+    def test_shows_keyset_pagination(self):
+        self.seed_venues(20)
+        self.addCleanup(app.config.__setitem__, 'SHOWS_PER_PAGE', app.config['SHOWS_PER_PAGE'])
+        app.config['SHOWS_PER_PAGE'] = 15
+
+        first_count, first_page = self.count_queries(lambda: self.client().get('/shows'))
+        cursor = first_page.data.split(b'after=')[1].split(b'"')[0].decode()
+        second_page = self.client().get('/shows?after=' + cursor)
+
+        self.assertEqual(first_page.status_code, 200)
+        self.assertEqual(first_count, 1)
+        self.assertEqual(first_page.data.count(b'tile-show'), 15)
+        self.assertEqual(second_page.data.count(b'tile-show'), 15)
+        self.assertIn(b'Next shows', second_page.data)
+
+    def test_shows_stream(self):
+        self.seed_venues(40)
+
+        response = self.client().get('/shows?stream=1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.count(b'tile-show'), 80)
+
+    def test_shows_invalid_cursor(self):
+        response = self.client().get('/shows?after=yesterday')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_venues_single_query(self):
+        self.seed_venues(12)
+
+        query_count, response = self.count_queries(
+            lambda: self.client().post('/venues/search', data={'search_term': 'venue 1'}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(query_count, 1)
+        self.assertIn(b'"venue 1": 3', response.data)
+
+    def test_detail_page_not_found(self):
+        response = self.client().get('/venues/1000')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_show_filters_use_indexes(self):
+        # Regression test for the (venue_id, start_time) and (artist_id, start_time) indexes.
+        self.seed_venues(20)
+        now = datetime.utcnow()
+        for fk, index in ((Show.venue_id, 'ix_Show_venue_id_start_time'),
+                          (Show.artist_id, 'ix_Show_artist_id_start_time')):
+            query = db.session.query(db.func.count(Show.id)).filter(fk == 1, Show.start_time > now)
+            statement = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+            if db.engine.dialect.name == 'postgresql':
+                db.session.execute('SET LOCAL enable_seqscan = off')
+                plan = ' '.join(row[0] for row in db.session.execute('EXPLAIN ' + statement))
+            else:
+                plan = ' '.join(row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + statement))
+
+            self.assertIn(index, plan)
+
+    def test_genre_filters(self):
+        self.seed_venues(2)
+        rock_venue = Venue(name='Rock Venue', city='New York', state='NY', address='1 Street',
+            phone='123-123-1234', genres=['Rock n Roll', 'Blues'])
+        rock_artist = Artist(name='Rock Artist', city='New York', state='NY', phone='123-123-1234',
+            genres=['Rock n Roll'])
+        db.session.add_all([rock_venue, rock_artist])
+        db.session.flush()
+        refresh_venue_areas([rock_venue.id])
+        db.session.commit()
+
+        areas = get_venue_areas('Rock n Roll')
+        venues_response = self.client().get('/venues?genre=Rock n Roll')
+        artists_response = self.client().get('/artists?genre=Rock n Roll')
+
+        self.assertEqual([venue['name'] for area in areas for venue in area['venues']], ['Rock Venue'])
+        self.assertIn(b'Rock Venue', venues_response.data)
+        self.assertNotIn(b'Venue 0', venues_response.data)
+        self.assertIn(b'Rock Artist', artists_response.data)
+        self.assertNotIn(b'<h5>Artist</h5>', artists_response.data)
+
+    def test_genre_filter_uses_index(self):
+        query = db.session.query(VenueGenre.venue_id).filter(VenueGenre.genre == 'Jazz')
+        statement = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('SET LOCAL enable_seqscan = off')
+            plan = ' '.join(row[0] for row in db.session.execute('EXPLAIN ' + statement))
+        else:
+            plan = ' '.join(row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + statement))
+
+        self.assertIn('ix_VenueGenre_genre', plan)
+
+    def test_edit_venue_genres(self):
+        self.seed_venues(1)
+        venue_id = Venue.query.first().id
+
+        self.client().post('/venues/%d/edit' % venue_id, data={
+            'name': 'Venue 0', 'genres': ['Jazz', 'Blues'], 'address': '0 Street', 'city': 'San Francisco',
+            'state': 'CA', 'phone': '123-123-1234', 'facebook_link': '', 'image_link': ''})
+        response = self.client().get('/venues/%d' % venue_id)
+
+        self.assertEqual(Venue.query.get(venue_id).genres, ['Blues', 'Jazz'])
+        self.assertIn(b'<span class="genre">Blues</span>', response.data)
+
+    def test_cached_pages(self):
+        artist_id = self.seed_venues(1).id
+        venue_id = Venue.query.first().id
+        db.session.expunge_all()
+
+        first_count, first_response = self.count_queries(lambda: self.client().get('/venues/%d' % venue_id))
+        cached_count, cached_response = self.count_queries(lambda: self.client().get('/venues/%d' % venue_id))
+
+        self.assertEqual(first_count, 2)
+        self.assertEqual(cached_count, 0)
+        self.assertEqual(cached_response.data, first_response.data)
+        self.assertIn(b'page_cache_hits_total{tier="local"} 1', self.client().get('/metrics').data)
+
+        self.client().get('/artists/%d' % artist_id)
+        self.client().post('/venues/%d/edit' % venue_id, data={
+            'name': 'Renamed Venue', 'genres': ['Jazz'], 'address': '0 Street', 'city': 'San Francisco',
+            'state': 'CA', 'phone': '123-123-1234', 'facebook_link': '', 'image_link': ''})
+
+        self.assertIn(b'Renamed Venue', self.client().get('/venues/%d' % venue_id).data)
+        self.assertIn(b'Renamed Venue', self.client().get('/artists/%d' % artist_id).data)
+        self.assertIn(b'Renamed Venue', self.client().get('/venues').data)
+
+    def test_pages_with_flash_messages_are_not_cached(self):
+        self.seed_venues(1)
+        self.client().get('/venues')
+        client = self.client()
+        client.post('/artists/create', data={
+            'name': 'New Artist', 'genres': ['Jazz'], 'city': 'San Francisco', 'state': 'CA',
+            'phone': '123-123-1234', 'facebook_link': '', 'image_link': ''})
+        with client.session_transaction() as session:
+            session['_flashes'] = [('message', 'Pending message')]
+
+        self.assertIn(b'Pending message', client.get('/venues').data)
+        self.assertNotIn(b'Pending message', self.client().get('/venues').data)
+        self.assertIn(b'New Artist', self.client().get('/artists').data)
+
+    def test_shared_page_cache_tier(self):
+        store = LocalStore()
+        store.set('other:key', 'kept')
+        first_worker = PageCache(LRUTier(), SharedTier(store))
+        second_worker = PageCache(LRUTier(), SharedTier(store))
+
+        key, _ = first_worker.get('venue:1')
+        first_worker.set(key, '<h1>Venue</h1>')
+        _, shared_hit = second_worker.get('venue:1')
+        _, local_hit = second_worker.get('venue:1')
+        first_worker.invalidate('venue:1')
+
+        self.assertEqual(shared_hit, '<h1>Venue</h1>')
+        self.assertEqual(local_hit, '<h1>Venue</h1>')
+        self.assertIsNone(second_worker.get('venue:1')[1])
+        self.assertEqual((second_worker.local.hits, second_worker.local.misses), (1, 2))
+        self.assertEqual((second_worker.shared.hits, second_worker.shared.misses), (1, 1))
+        self.assertIn('page_cache_misses_total{tier="shared"} 1', second_worker.metrics_text())
+
+        first_worker.clear()
+        self.assertEqual(list(store.scan_iter()), ['other:key'])
+
+    def test_page_rendered_during_invalidation_is_not_served(self):
+        cache = PageCache(LRUTier())
+
+        key, _ = cache.get('venue:1')
+        # a controller commits and invalidates while the page is rendered
+        cache.invalidate('venue:1')
+        cache.set(key, '<h1>Old venue</h1>')
+
+        self.assertIsNone(cache.get('venue:1')[1])
+
+    def test_lru_tier_is_bounded(self):
+        tier = LRUTier(max_entries=2)
+        tier.set('first', 'page')
+        tier.set('second', 'page')
+        tier.get('first')
+        tier.set('third', 'page')
+
+        self.assertEqual(list(tier.entries), ['first', 'third'])
+
+    def write_import_file(self, name, content):
+        path = os.path.join(self.import_dir.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def test_import_data(self):
+        self.import_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.import_dir.cleanup)
+        venues = self.write_import_file('venues.csv',
+            'id,name,city,state,address,phone,image_link,facebook_link,genres\n'
+            'v1,The Musical Hop,San Francisco,CA,1015 Folsom Street,123-123-1234,,https://facebook.com/hop,"Jazz,Reggae"\n'
+            'v2,Park Square,San Francisco,CA,34 Whiskey Moore Ave,415-000-1234,,https://facebook.com/park,Rock n Roll\n'
+            'v3,,New York,NY,No Name Street,,,https://facebook.com/none,Jazz\n'
+            'v4,The Dueling Pianos,New York,NY,335 Delancey Street,914-003-1132,,https://facebook.com/pianos,Classical\n')
+        artists = self.write_import_file('artists.ndjson', '\n'.join(json.dumps(row) for row in [
+            {'id': 'a1', 'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA', 'phone': '326-123-5000',
+             'facebook_link': 'https://facebook.com/gnp', 'genres': ['Rock n Roll']},
+            {'id': 'a2', 'name': 'Matt Quevedo', 'city': 'New York', 'state': 'XX', 'phone': '300-400-5000',
+             'facebook_link': 'https://facebook.com/mq', 'genres': ['Jazz']},
+        ]) + '\nnot json\n')
+        shows = self.write_import_file('shows.csv',
+            'venue_id,artist_id,start_time\n'
+            'v1,a1,2035-04-01 20:00:00\n'
+            'v2,a1,2019-06-15 23:00:00\n'
+            'v2,a2,2035-04-01 20:00:00\n')
+
+        output = []
+        venue_stats = import_rows('venues', venues, chunk_size=2, log=output.append)
+        artist_stats = import_rows('artists', artists, chunk_size=2, log=output.append)
+        show_stats = import_rows('shows', shows, chunk_size=2, log=output.append)
+
+        self.assertEqual(venue_stats, {'imported': 3, 'rejected': 1})
+        self.assertEqual(artist_stats, {'imported': 1, 'rejected': 2})
+        self.assertEqual(show_stats, {'imported': 2, 'rejected': 1})
+        self.assertIn('line 4: ', output[1])
+        self.assertIn('rows/s', output[-1])
+        self.assertEqual(Venue.query.filter_by(name='The Musical Hop').one().genres, ['Jazz', 'Reggae'])
+        areas = {venue['name']: venue['num_upcoming_shows'] for area in get_venue_areas() for venue in area['venues']}
+        self.assertEqual(areas, {'The Musical Hop': 1, 'Park Square': 0, 'The Dueling Pianos': 0})
+
+        # resumes after the rows already imported
+        with open(venues, 'a') as file:
+            file.write('v5,The Blue Note,New York,NY,131 W 3rd St,212-475-8592,,https://facebook.com/bluenote,Jazz\n')
+        result = app.test_cli_runner().invoke(args=['import-data', 'venues', venues])
+
+        self.assertIn('venues: 1 imported, 0 rejected', result.output)
+        self.assertEqual(Venue.query.count(), 4)
+
+    def test_import_data_resumes_after_a_crash(self):
+        self.import_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.import_dir.cleanup)
+        venues = self.write_import_file('venues.ndjson', '\n'.join(json.dumps({
+            'id': 'v%d' % i, 'name': 'Venue %d' % i, 'city': 'San Francisco', 'state': 'CA',
+            'address': '%d Street' % i, 'phone': '123-123-1234', 'facebook_link': 'https://facebook.com/v%d' % i,
+            'genres': ['Jazz']
+        }) for i in range(3)) + '\n')
+
+        # the process dies right after the first chunk is committed
+        with mock.patch.object(page_cache, 'invalidate', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                import_rows('venues', venues, chunk_size=2, log=lambda message: None)
+        db.session.remove()
+        stats = import_rows('venues', venues, chunk_size=2, log=lambda message: None)
+        # another file of the data set repeating a source id
+        venues_again = self.write_import_file('venues_again.ndjson', json.dumps({
+            'id': 'v1', 'name': 'Venue 1 again', 'city': 'San Francisco', 'state': 'CA', 'address': '1 Street',
+            'phone': '123-123-1234', 'facebook_link': 'https://facebook.com/v1', 'genres': ['Jazz']
+        }) + '\n')
+        duplicate_stats = import_rows('venues', venues_again, log=lambda message: None)
+
+        self.assertEqual(stats, {'imported': 1, 'rejected': 0})
+        self.assertEqual(duplicate_stats, {'imported': 0, 'rejected': 1})
+        self.assertEqual(sorted(venue.name for venue in Venue.query), ['Venue 0', 'Venue 1', 'Venue 2'])
+
+    def test_format_datetime_accepts_datetimes_and_strings(self):
+        start_time = datetime(2035, 4, 1, 20, 0)
+
+        self.assertEqual(format_datetime(start_time, 'full'), 'Sunday April, 1, 2035 at 8:00PM')
+        self.assertEqual(format_datetime(str(start_time), 'full'), format_datetime(start_time, 'full'))
+        self.assertEqual(format_datetime(start_time), 'Sun 04, 01, 2035 8:00PM')
+
+    @unittest.skipUnless(os.environ.get('FYYUR_BENCHMARK'), 'set FYYUR_BENCHMARK=1 to run the show tiles rendering benchmark')
+    def test_format_datetime_benchmark(self):
+        def legacy_format_datetime(value, format):
+            return babel.dates.format_datetime(dateutil.parser.parse(value), "EEEE MMMM, d, y 'at' h:mma")
+
+        env = app.jinja_env.overlay()
+        env.filters = dict(app.jinja_env.filters, legacy_datetime=legacy_format_datetime)
+        tile = '<h5>{{ show.artist_name }}</h5><h4>{{ %s }}</h4>'
+        legacy_template = env.from_string(
+            '{% for show in shows %}' + tile % "(show.start_time | string) | legacy_datetime('full')" + '{% endfor %}')
+        template = env.from_string('{% for show in shows %}' + tile % "show.start_time | datetime('full')" + '{% endfor %}')
+        shows = [{
+            'artist_name': 'Artist %d' % i,
+            'start_time': datetime(2035, 1, 1) + timedelta(hours=i)
+        } for i in range(10000)]
+
+        started = time.perf_counter()
+        legacy_html = legacy_template.render(shows=shows)
+        legacy_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        html = template.render(shows=shows)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(html, legacy_html)
+        self.assertLess(elapsed, legacy_elapsed)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
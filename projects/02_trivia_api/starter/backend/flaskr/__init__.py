@@ -1,15 +1,26 @@
 import os
+import io
 import sys
-import random
-from flask import Flask, request, abort
+import csv
+import json
+import click
+from flask import Flask, Response, request, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 
 
-from models import setup_db, Question, Category
+from models import db, setup_db, create_db, migrate_question_category, get_questions_count, get_question_ids, invalidate_question_caches, \
+  get_categories, get_category_type, get_categories_version, \
+  bulk_insert_questions, bulk_update_questions, bulk_delete_questions, BULK_CHUNK_SIZE, \
+  find_questions, Question
 from utils import success_response, error_response
+from quiz import pick_random_id, QuizSessions
+from db_config import pool_metrics_text
 
 QUESTIONS_PER_PAGE = 10
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+EXPORT_BATCH_SIZE = 1000
+CATEGORIES_MAX_AGE = 300
 
 def create_app(test_config=None):
   # create and configure the app
@@ -33,17 +44,22 @@ def create_app(test_config=None):
   @app.after_request
   def after_request(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PATCH, DELETE'
     return response
 
   '''
   Create an endpoint categories to handle GET requests for all available categories.
+  The response carries an ETag of the categories cache version, so clients and 
+  proxies can revalidate with If-None-Match and get a 304 without a body. 
   '''
   @app.route('/categories')
   def categories():    
     categories = get_formatted_categories()
     if categories:
-      return success_response(categories)
+      response = success_response(categories)
+      response.set_etag(get_categories_version())
+      response.headers['Cache-Control'] = 'public, max-age={}'.format(CATEGORIES_MAX_AGE)
+      return response.make_conditional(request)
     else:
       return error_response()
 
@@ -53,25 +69,36 @@ def create_app(test_config=None):
   including pagination (every 10 questions). 
   This endpoint should return a list of questions, 
   number of total questions, current category, categories. 
+  Passing ?cursor=<next_cursor> instead of ?page= pages by id (keyset) 
+  so deep pages cost the same as the first one. 
   '''
   @app.route('/questions')
   def questions():
     try:
-      page = request.args.get('page', 1, type=int)
-      offset = (page - 1) * QUESTIONS_PER_PAGE
-      take = offset + QUESTIONS_PER_PAGE
+      query = Question.query.order_by(Question.id)
+      cursor = request.args.get('cursor', type=int)
+      if cursor is not None:
+        query = query.filter(Question.id > cursor)
+      else:
+        page = request.args.get('page', 1, type=int)
+        query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
 
-      questions = Question.query.all()
-      requested_questions = questions[offset:take]
+      # One extra row tells whether there is a next page.
+      requested_questions = query.limit(QUESTIONS_PER_PAGE + 1).all()
+      next_cursor = None
+      if len(requested_questions) > QUESTIONS_PER_PAGE:
+        requested_questions = requested_questions[:-1]
+        next_cursor = requested_questions[-1].id
 
       formatted_questions = [question.format() for question in requested_questions]
       categories = get_formatted_categories()
 
       data = {
         'questions': formatted_questions,
-        'total_questions': len(questions),
+        'total_questions': get_questions_count(),
         'categories': categories,
-        'current_category': requested_questions[0].category
+        'current_category': requested_questions[0].category if requested_questions else None,
+        'next_cursor': next_cursor
       }
 
       return success_response(data)
@@ -119,10 +146,187 @@ def create_app(test_config=None):
       return abort(400)
         
 
+  '''
+  Batch endpoints to POST (create), PATCH (update by id) and DELETE many questions at once. 
+  POST and PATCH take a JSON array of questions, or NDJSON (one JSON question per line) 
+  sent with the application/x-ndjson content type. DELETE takes {"ids": [...]}. 
+  Valid rows are written in chunks of BULK_CHUNK_SIZE rows per transaction, 
+  invalid rows are skipped and reported with their index. 
+  '''
+  @app.route('/questions/batch', methods=['POST'])
+  def add_questions_batch():
+    try:
+      rows, errors = read_batch_rows()
+      valid_rows = []
+      for index, row in rows:
+        message = validate_question(row)
+        if message:
+          errors.append({'index': index, 'message': message})
+        else:
+          valid_rows.append((index, {field: row[field] for field in QUESTION_FIELDS}))
+
+      inserted = write_in_chunks(bulk_insert_questions, valid_rows, errors)
+
+      return success_response({'inserted': inserted, 'errors': errors})
+    except:
+      return abort(400)
+
+  @app.route('/questions/batch', methods=['PATCH'])
+  def update_questions_batch():
+    try:
+      rows, errors = read_batch_rows()
+      valid_rows = []
+      for index, row in rows:
+        message = validate_question(row, update=True)
+        if message:
+          errors.append({'index': index, 'message': message})
+        else:
+          valid_rows.append((index, {field: row[field] for field in ('id',) + QUESTION_FIELDS if field in row}))
+
+      updated = 0
+      for start in range(0, len(valid_rows), BULK_CHUNK_SIZE):
+        chunk = valid_rows[start:start + BULK_CHUNK_SIZE]
+        try:
+          chunk_updated, missing_ids = bulk_update_questions([row for _, row in chunk])
+        except:
+          db.session.rollback()
+          errors.extend({'index': index, 'message': 'Unable to save this question.'} for index, _ in chunk)
+          continue
+        updated += chunk_updated
+        errors.extend({'index': index, 'message': 'Question #ID not found.'}
+          for index, row in chunk if row['id'] in missing_ids)
+
+      return success_response({'updated': updated, 'errors': errors})
+    except:
+      return abort(400)
+
+  @app.route('/questions/batch', methods=['DELETE'])
+  def delete_questions_batch():
+    try:
+      ids = request.get_json()['ids']
+      if not isinstance(ids, list):
+        return error_response(message='A list of question #IDs is required.')
+
+      errors = []
+      valid_ids = []
+      for index, question_id in enumerate(ids):
+        if isinstance(question_id, int) and not isinstance(question_id, bool):
+          valid_ids.append((index, question_id))
+        else:
+          errors.append({'index': index, 'message': 'Question #ID must be an integer.'})
+
+      deleted = write_in_chunks(bulk_delete_questions, valid_ids, errors)
+
+      return success_response({'deleted': deleted, 'errors': errors})
+    except:
+      return abort(400)
+
+  def read_batch_rows():
+    rows = []
+    errors = []
+    if request.mimetype == 'application/x-ndjson':
+      # Read line by line from the request stream instead of buffering the whole body.
+      for index, line in enumerate(request.stream):
+        if not line.strip():
+          continue
+        try:
+          rows.append((index, json.loads(line)))
+        except ValueError:
+          errors.append({'index': index, 'message': 'Invalid JSON line.'})
+    else:
+      body = request.get_json()
+      if not isinstance(body, list):
+        raise ValueError('A JSON array of questions is required.')
+      rows = list(enumerate(body))
+
+    return rows, errors
+
+  def validate_question(row, update=False):
+    if not isinstance(row, dict):
+      return 'Each question must be a JSON object.'
+
+    if update:
+      if not isinstance(row.get('id'), int) or isinstance(row.get('id'), bool):
+        return 'Question #ID is required.'
+      fields = [field for field in QUESTION_FIELDS if field in row]
+      if not fields or not all(row[field] for field in fields):
+        return 'Question, answer, category & difficulty score can not be empty.'
+    elif not all(row.get(field) for field in QUESTION_FIELDS):
+      return 'Question, answer, category & difficulty score are required fields.'
+
+    for field, message in (('category', 'Category #ID must be a number.'), ('difficulty', 'Difficulty score must be a number.')):
+      if field in row:
+        try:
+          int(row[field])
+        except (TypeError, ValueError):
+          return message
+
+    return None
+
+  def write_in_chunks(write, indexed_rows, errors):
+    written = 0
+    for start in range(0, len(indexed_rows), BULK_CHUNK_SIZE):
+      chunk = indexed_rows[start:start + BULK_CHUNK_SIZE]
+      try:
+        written += write([row for _, row in chunk])
+      except:
+        db.session.rollback()
+        errors.extend({'index': index, 'message': 'Unable to save this question.'} for index, _ in chunk)
+
+    return written
+
+  '''
+  A GET endpoint to export the question bank as NDJSON (default) or CSV (?format=csv), 
+  optionally filtered by ?category= and ?difficulty=. 
+  Rows are streamed from a server-side cursor EXPORT_BATCH_SIZE at a time, 
+  so memory use doesn't grow with the size of the table. 
+  '''
+  @app.route('/questions/export')
+  def export_questions():
+    export_format = request.args.get('format', 'ndjson')
+    category = request.args.get('category', type=int)
+    difficulty = request.args.get('difficulty', type=int)
+    if export_format not in ('ndjson', 'csv'):
+      return error_response(message='Export format must be ndjson or csv.'), 400
+
+    columns = (Question.id,) + tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+    query = db.session.query(*columns).order_by(Question.id)
+    if category is not None:
+      query = query.filter(Question.category == category)
+    if difficulty is not None:
+      query = query.filter(Question.difficulty == difficulty)
+    rows = query.execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+
+    names = ('id',) + QUESTION_FIELDS
+
+    def generate_ndjson():
+      for row in rows:
+        yield json.dumps(dict(zip(names, row))) + '\n'
+
+    def generate_csv():
+      buffer = io.StringIO()
+      writer = csv.writer(buffer)
+      writer.writerow(names)
+      for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if export_format == 'csv':
+      generate, mimetype = generate_csv, 'text/csv'
+    else:
+      generate, mimetype = generate_ndjson, 'application/x-ndjson'
+
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+      'Content-Disposition': 'attachment; filename=questions.{}'.format(export_format)
+    })
+
   '''
   A POST endpoint to get questions based on a search term. 
   It should return any questions for whom the search term 
-  is a substring of the question. 
+  is a substring of the question or of the answer, ranked by relevance 
+  and paginated like GET /questions ("page" in the body, 1 by default). 
   '''
   # Notice: It's better to make the search GET request passing the search term in param (?search=)
   # but it's impelmented as this route (which is not the best endpoint) for avoiding duplications of same endpoint & method.
@@ -130,14 +334,16 @@ def create_app(test_config=None):
   def search_questions():
     try:
       search_term = request.get_json()['search_term']
+      page = int(request.get_json().get('page', 1))
 
-      if search_term:
-        found_questions = Question.query.filter(Question.question.ilike(f'%{search_term}%')).all()
+      if search_term and page >= 1:
+        found_questions, total = find_questions(search_term, page, QUESTIONS_PER_PAGE)
         questions = [question.format() for question in found_questions]
 
         data = {
           'questions': questions,
-          'total_questions': len(questions)
+          'total_questions': total,
+          'page': page
         }
 
         return success_response(data)
@@ -159,7 +365,9 @@ def create_app(test_config=None):
           return error_response(message="No questions are founds inside this category.")
         
         formatted_questions = [question.format() for question in questions]
-        category = Category.query.get(category_id).type
+        category = get_category_type(category_id)
+        if category is None:
+          return error_response(message="Invalid category #ID is provided.")
 
         data = {
           'current_category': category,
@@ -187,32 +395,100 @@ def create_app(test_config=None):
       previous_questions = request.get_json()['previous_questions']
 
       if (category_id or category_id == 0) and isinstance(previous_questions, list):
-        if category_id == 0:
-          questions = Question.query.filter(~Question.id.in_(previous_questions)).all()
-        else:
-          questions = Question.query.filter(Question.category == category_id, ~Question.id.in_(previous_questions)).all()
-        
-        if len(questions) == 0:
-          return success_response(None)
+        excluded_ids = list(previous_questions)
+        while True:
+          question_id = pick_random_id(get_question_ids(category_id), excluded_ids)
+          if question_id is None:
+            return success_response(None)
+
+          question = Question.query.get(question_id)
+          if question is not None:
+            return success_response(question.format())
+          # Deleted by another worker since the ids were cached.
+          invalidate_question_caches()
+          excluded_ids.append(question_id)
+      else:
+        return success_response(message='Category #ID and previous questions must be provided.')
+    except:
+      return abort(400)
+
+
+  '''
+  Quiz sessions: POST /quiz/sessions with a category_id starts a game and 
+  returns its session_id, then every POST /quiz/sessions/<session_id>/next 
+  returns the next random question of the game (None once all were played) 
+  without resending the previous questions. 
+  '''
+  quiz_sessions = QuizSessions()
 
-        selected_question = random.choice(questions).format()
+  @app.route('/quiz/sessions', methods=['POST'])
+  def start_quiz_session():
+    try:
+      category_id = request.get_json()['category_id']
+
+      if category_id or category_id == 0:
+        question_ids = get_question_ids(category_id)
+        data = {
+          'session_id': quiz_sessions.start(question_ids),
+          'total_questions': len(question_ids)
+        }
 
-        return success_response(selected_question)
+        return success_response(data)
       else:
-        return success_response(message='Category #ID and previous questions must be provided.')
+        return error_response(message='Category #ID must be provided.')
+    except:
+      return abort(400)
+
+  @app.route('/quiz/sessions/<session_id>/next', methods=['POST'])
+  def next_quiz_question(session_id):
+    try:
+      question = None
+      while question is None:
+        question_id = quiz_sessions.next_id(session_id)
+        if question_id is None:
+          return success_response(None)
+        # Skips questions deleted since the session started.
+        question = Question.query.get(question_id)
+
+      return success_response(question.format())
+    except KeyError:
+      return error_response(message='Quiz session is not found or has expired.', code=404), 404
     except:
       return abort(400)
 
 
   def get_formatted_categories():
-    categories = Category.query.all()
-    if len(categories) == 0:
+    formatted_categories = get_categories()
+    if len(formatted_categories) == 0:
       return False;
 
-    formatted_categories = [category.format() for category in categories]
-
     return formatted_categories
 
+  '''
+  Database pool metrics (connection checkout wait time) of this process, 
+  in the Prometheus text format. 
+  '''
+  @app.route('/metrics')
+  def metrics():
+    return Response(pool_metrics_text(), mimetype='text/plain; version=0.0.4')
+
+  '''
+  CLI command (flask init-db) creating the tables and search indexes, 
+  see create_db. 
+  '''
+  @app.cli.command('init-db')
+  def init_db_command():
+    create_db()
+    click.echo('Database initialized.')
+
+  '''
+  CLI command (flask migrate-question-category) converting questions.category 
+  to an indexed integer foreign key online, see migrate_question_category. 
+  '''
+  @app.cli.command('migrate-question-category')
+  def migrate_question_category_command():
+    migrate_question_category()
+
   '''
   Error handlers for all expected errors 
   including 404, 422. and 400 
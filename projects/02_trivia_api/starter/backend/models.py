@@ -1,7 +1,10 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import time
+import hashlib
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, event
 from flask_sqlalchemy import SQLAlchemy
 import json
+from db_config import engine_options
 
 database_name = "trivia"
 database_user = 'postgres'
@@ -18,9 +21,70 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
+
+'''
+create_db()
+    creates the missing tables and the search indexes.
+    Not part of setup_db, so creating an app does no database I/O (the engine
+    is only connected on the first query); run it once per database with
+    flask init-db
+'''
+def create_db():
     db.create_all()
+    create_search_indexes()
+
+'''
+create_search_indexes()
+    trigram GIN indexes on the question and answer texts, so the ILIKE
+    '%term%' search doesn't scan the whole table (Postgres only)
+'''
+def create_search_indexes():
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.begin() as connection:
+        connection.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions USING gin (question gin_trgm_ops)')
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm ON questions USING gin (answer gin_trgm_ops)')
+
+'''
+Question caches
+    the questions count and the per-category question ids, kept per process.
+    Both are dropped on every insert/delete done through the models and
+    refreshed after QUESTIONS_CACHE_TTL seconds to pick up writes made by
+    other workers.
+'''
+QUESTIONS_CACHE_TTL = 60
+questions_cache = {}
+
+def get_cached(key, load):
+    entry = questions_cache.get(key)
+    if entry is None or entry[1] <= time.monotonic():
+        entry = (load(), time.monotonic() + QUESTIONS_CACHE_TTL)
+        questions_cache[key] = entry
+    return entry[0]
+
+def get_questions_count():
+    return get_cached('count', lambda: db.session.query(db.func.count(Question.id)).scalar())
+
+'''
+get_question_ids(category_id)
+    ids of every question in the category (or all questions for category 0),
+    so the quiz can sample one without loading the candidate rows.
+'''
+def get_question_ids(category_id=0):
+    def load():
+        query = db.session.query(Question.id)
+        if category_id:
+            query = query.filter(Question.category == category_id)
+        return [question_id for question_id, in query]
+
+    return get_cached(('ids', category_id), load)
+
+def invalidate_question_caches():
+    questions_cache.clear()
 
 '''
 Question
@@ -28,11 +92,15 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    # Serves category listings and quiz id sampling as index-only scans.
+    Index('ix_questions_category_id', 'category', 'id'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -44,13 +112,16 @@ class Question(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    invalidate_question_caches()
   
   def update(self):
     db.session.commit()
+    invalidate_question_caches()
 
   def delete(self):
     db.session.delete(self)
     db.session.commit()
+    invalidate_question_caches()
 
   def format(self):
     return {
@@ -61,6 +132,156 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+'''
+Bulk question writes
+    each chunk of rows is written with a single multi-row statement and
+    committed in its own transaction, instead of one commit per question.
+    Every function takes one chunk and returns the number of affected rows
+    (bulk_update_questions also returns the ids not found).
+'''
+BULK_CHUNK_SIZE = 1000
+
+def bulk_insert_questions(rows):
+  try:
+    db.session.bulk_insert_mappings(Question, rows)
+    db.session.commit()
+  finally:
+    invalidate_question_caches()
+  return len(rows)
+
+'''
+bulk_update_questions(rows)
+    updates the rows whose id exists (locked until the commit, so none can
+    disappear before the update) and skips the others.
+    returns (number of updated rows, ids not found)
+'''
+def bulk_update_questions(rows):
+  try:
+    ids = [row['id'] for row in rows]
+    existing_ids = set(question_id for question_id, in
+      db.session.query(Question.id).filter(Question.id.in_(ids)).with_for_update())
+    existing_rows = [row for row in rows if row['id'] in existing_ids]
+    db.session.bulk_update_mappings(Question, existing_rows)
+    db.session.commit()
+  finally:
+    invalidate_question_caches()
+  return len(existing_rows), set(ids) - existing_ids
+
+def bulk_delete_questions(ids):
+  try:
+    deleted = Question.query.filter(Question.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+  finally:
+    invalidate_question_caches()
+  return deleted
+
+'''
+find_questions(search_term, page, per_page)
+    questions whose question or answer contains the search term, one page at a
+    time, with the total number of matches counted in the same query (a page
+    past the last one has no rows to carry it, so it is counted separately).
+    On Postgres the matches are served by the trigram indexes and ranked by how
+    closely the question, then the answer, matches the term; other databases
+    order them by id.
+    returns (questions, total)
+'''
+def find_questions(search_term, page=1, per_page=10):
+    pattern = f'%{search_term}%'
+    matches = db.or_(Question.question.ilike(pattern), Question.answer.ilike(pattern))
+    query = db.session.query(Question, db.func.count().over()).filter(matches)
+
+    if db.engine.dialect.name == 'postgresql':
+      query = query.order_by(
+        db.func.word_similarity(search_term, Question.question).desc(),
+        db.func.word_similarity(search_term, Question.answer).desc(),
+        Question.id)
+    else:
+      query = query.order_by(Question.id)
+
+    rows = query.limit(per_page).offset((page - 1) * per_page).all()
+    if rows:
+      total = rows[0][1]
+    elif page > 1:
+      total = db.session.query(db.func.count(Question.id)).filter(matches).scalar()
+    else:
+      total = 0
+
+    return [question for question, _ in rows], total
+
+'''
+migrate_question_category(batch_size, log)
+    online migration of questions.category from a string column (databases
+    created before it was an integer) to an indexed integer foreign key, on Postgres.
+    A temporary trigger keeps a new integer column in sync with every write
+    while the existing rows are copied in batches of batch_size rows, each in
+    its own transaction, and the (category, id) index is built concurrently,
+    so the table stays readable and writable. The final column swap only
+    drops, renames and adds a NOT VALID constraint, without scanning the table;
+    the constraint is validated afterwards without blocking writes.
+    Databases that already have the integer column only get the index.
+'''
+CATEGORY_TO_INTEGER = "CASE WHEN {0} ~ '^[0-9]+$' THEN {0}::integer END"
+
+def migrate_question_category(batch_size=BULK_CHUNK_SIZE, log=print):
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        log('Only Postgres databases need migrating.')
+        return
+
+    column_type = engine.execute(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'questions' AND column_name = 'category'").scalar()
+
+    if column_type != 'integer':
+        with engine.begin() as connection:
+            connection.execute('ALTER TABLE questions ADD COLUMN IF NOT EXISTS category_id integer')
+            connection.execute(
+                'CREATE OR REPLACE FUNCTION questions_sync_category_id() RETURNS trigger AS $$ '
+                'BEGIN NEW.category_id := {}; RETURN NEW; END $$ LANGUAGE plpgsql'
+                .format(CATEGORY_TO_INTEGER.format('NEW.category')))
+            connection.execute('DROP TRIGGER IF EXISTS questions_sync_category_id ON questions')
+            # Creating the trigger waits for the running writes, every later
+            # write goes through it, so the batches below miss no change.
+            connection.execute(
+                'CREATE TRIGGER questions_sync_category_id BEFORE INSERT OR UPDATE OF category ON questions '
+                'FOR EACH ROW EXECUTE PROCEDURE questions_sync_category_id()')
+
+        last_id = 0
+        migrated = 0
+        while True:
+            with engine.begin() as connection:
+                ids = [row[0] for row in connection.execute(
+                    'SELECT id FROM questions WHERE id > %s ORDER BY id LIMIT %s', (last_id, batch_size))]
+                if not ids:
+                    break
+                connection.execute(
+                    'UPDATE questions SET category_id = {} WHERE id >= %s AND id <= %s'
+                    .format(CATEGORY_TO_INTEGER.format('category')),
+                    (ids[0], ids[-1]))
+            last_id = ids[-1]
+            migrated += len(ids)
+            log('Migrated {} questions.'.format(migrated))
+
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        indexed_column = 'category' if column_type == 'integer' else 'category_id'
+        connection.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_category_id ON questions ({}, id)'.format(indexed_column))
+
+    if column_type != 'integer':
+        with engine.begin() as connection:
+            connection.execute('DROP TRIGGER questions_sync_category_id ON questions')
+            connection.execute('DROP FUNCTION questions_sync_category_id()')
+            connection.execute('ALTER TABLE questions DROP COLUMN category')
+            connection.execute('ALTER TABLE questions RENAME COLUMN category_id TO category')
+            connection.execute(
+                'ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY (category) REFERENCES categories (id) '
+                'ON UPDATE CASCADE ON DELETE SET NULL NOT VALID')
+        engine.execute('ALTER TABLE questions VALIDATE CONSTRAINT category')
+
+    invalidate_question_caches()
+    log('questions.category is an indexed integer foreign key.')
+
 '''
 Category
 
@@ -78,4 +299,44 @@ class Category(db.Model):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+Categories cache
+    the formatted categories, an id -> type map and a version (digest of the
+    categories) usable as an ETag, kept per process.
+    Dropped whenever a category is inserted, updated or deleted through the
+    ORM and refreshed after CATEGORIES_CACHE_TTL seconds to pick up changes
+    made by other workers.
+'''
+CATEGORIES_CACHE_TTL = 300
+categories_cache = {}
+
+def get_categories_cache():
+    if categories_cache.get('expires_at', 0) <= time.monotonic():
+        categories = [category.format() for category in Category.query.order_by(Category.id).all()]
+        categories_cache.update({
+            'categories': categories,
+            'types': {category['id']: category['type'] for category in categories},
+            'version': hashlib.sha1(json.dumps(categories, sort_keys=True).encode()).hexdigest(),
+            'expires_at': time.monotonic() + CATEGORIES_CACHE_TTL
+        })
+    return categories_cache
+
+def get_categories():
+    return get_categories_cache()['categories']
+
+def get_category_type(category_id):
+    return get_categories_cache()['types'].get(category_id)
+
+def get_categories_version():
+    return get_categories_cache()['version']
+
+def invalidate_categories():
+    categories_cache.clear()
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def on_category_change(mapper, connection, target):
+    invalidate_categories()
@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Random draws tried before falling back to scanning for the eligible ids.
+MAX_REJECTIONS = 32
+
+'''
+pick_random_id(ids, previous_ids)
+    picks a random id from ids that is not one of previous_ids.
+    Rejection sampling keeps this O(1) while most ids are still eligible,
+    the eligible list is only built once nearly every id has been played.
+    Returns None when every id was already played.
+'''
+def pick_random_id(ids, previous_ids):
+  if len(ids) == 0:
+    return None
+
+  previous_ids = set(previous_ids)
+  for _ in range(MAX_REJECTIONS):
+    candidate = random.choice(ids)
+    if candidate not in previous_ids:
+      return candidate
+
+  eligible_ids = [question_id for question_id in ids if question_id not in previous_ids]
+  if len(eligible_ids) == 0:
+    return None
+
+  return random.choice(eligible_ids)
+
+'''
+QuizSessions
+    server-side quiz games. Starting a session shuffles the category question
+    ids once, then every turn only moves the session position forward, so the
+    client doesn't resend the previous questions.
+    Sessions live in process, the least recently used ones are evicted past
+    max_sessions and any session idle for ttl seconds expires.
+'''
+class QuizSessions:
+  def __init__(self, max_sessions=10000, ttl=3600):
+    self.max_sessions = max_sessions
+    self.ttl = ttl
+    self.sessions = OrderedDict()
+    self.lock = threading.Lock()
+
+  def start(self, question_ids):
+    order = list(question_ids)
+    random.shuffle(order)
+    session_id = uuid.uuid4().hex
+
+    with self.lock:
+      self.evict()
+      self.sessions[session_id] = {
+        'order': order,
+        'position': 0,
+        'expires_at': time.monotonic() + self.ttl
+      }
+      while len(self.sessions) > self.max_sessions:
+        self.sessions.popitem(last=False)
+
+    return session_id
+
+  '''
+  next_id(session_id)
+      returns the next question id of the session, None once every question
+      was played. Raises KeyError for unknown or expired sessions.
+  '''
+  def next_id(self, session_id):
+    with self.lock:
+      self.evict()
+      session = self.sessions[session_id]
+      self.sessions.move_to_end(session_id)
+      session['expires_at'] = time.monotonic() + self.ttl
+
+      if session['position'] >= len(session['order']):
+        return None
+      question_id = session['order'][session['position']]
+      session['position'] += 1
+
+    return question_id
+
+  def evict(self):
+    # Sessions are kept in last-access order, so the expired ones are at the front.
+    now = time.monotonic()
+    while self.sessions:
+      session_id, session = next(iter(self.sessions.items()))
+      if session['expires_at'] > now:
+        break
+      del self.sessions[session_id]
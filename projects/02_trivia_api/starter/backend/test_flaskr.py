@@ -1,31 +1,39 @@
 import os
+import time
+import sqlite3
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import setup_db, create_db, bulk_insert_questions, migrate_question_category, BULK_CHUNK_SIZE, \
+    Question, Category
+from quiz import pick_random_id, QuizSessions
+from db_config import engine_options, pool_metrics, pool_metrics_text, TimedNullPool, TimedQueuePool
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    database_name = "trivia_test"
+    # Added database username & password in next 
+    database_path = "postgres://{}:{}@{}/{}".format('postgres', 'root', 'localhost:5432', database_name)
+    # database_path = "postgres://{}/{}".format('postgres', 'root', 'localhost:5432', database_name)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create the missing tables once for all the tests"""
+        app = create_app()
+        setup_db(app, cls.database_path)
+        with app.app_context():
+            create_db()
+
     def setUp(self):
         """Define test variables and initialize app."""
         self.app = create_app()
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        # Added database username & password in next 
-        self.database_path = "postgres://{}:{}@{}/{}".format('postgres', 'root', 'localhost:5432', self.database_name)
-        # self.database_path = "postgres://{}/{}".format('postgres', 'root', 'localhost:5432', self.database_name)
         setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
     
     def tearDown(self):
         """Executed after reach test"""
@@ -42,6 +50,15 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertGreaterEqual(len(data['data']), 1)
     
+    def test_get_categories_not_modified(self):
+        response = self.client().get('/categories')
+        cached_response = self.client().get('/categories', headers={'If-None-Match': response.headers['ETag']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response.headers['Cache-Control'])
+        self.assertEqual(cached_response.status_code, 304)
+        self.assertEqual(cached_response.data, b'')
+
     def test_get_questions_with_results(self):
         response = self.client().get('/questions')
         data = json.loads(response.data)
@@ -51,6 +68,29 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertGreaterEqual(len(data['data']), 1)
     
+    def test_get_questions_with_cursor(self):
+        first_page = json.loads(self.client().get('/questions').data)['data']
+        response = self.client().get('/questions?cursor={}'.format(first_page['next_cursor']))
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['data']['total_questions'], first_page['total_questions'])
+        self.assertTrue(all(question['id'] > first_page['next_cursor'] for question in data['data']['questions']))
+
+    def test_get_questions_last_page(self):
+        total = json.loads(self.client().get('/questions').data)['data']['total_questions']
+        last_page = (total + 9) // 10
+        response = self.client().get('/questions?page={}'.format(last_page))
+        empty_response = self.client().get('/questions?page={}'.format(last_page + 1))
+        data = json.loads(response.data)
+        empty_data = json.loads(empty_response.data)
+
+        self.assertIsNone(data['data']['next_cursor'])
+        self.assertEqual(empty_response.status_code, 200)
+        self.assertEqual(empty_data['data']['questions'], [])
+        self.assertIsNone(empty_data['data']['current_category'])
+
     def test_delete_question_with_result(self):
         response = self.client().delete('/questions/21')
         data = json.loads(response.data)
@@ -91,6 +131,90 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Bad request as maybe the resource requested is not found, missing fields or wrong request.')
         
+    def test_add_questions_batch_with_result(self):
+        response = self.client().post('/questions/batch', json=[
+            {'question': 'Batch question one?', 'answer': 'One', 'category': 1, 'difficulty': 1},
+            {'question': 'Batch question two?', 'answer': 'Two', 'category': 2, 'difficulty': 2},
+            {'question': 'Missing fields?'}
+        ])
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['data']['inserted'], 2)
+        self.assertEqual(data['data']['errors'][0]['index'], 2)
+
+    def test_add_questions_batch_ndjson(self):
+        lines = [json.dumps({'question': 'NDJSON question {}?'.format(i), 'answer': 'Yes', 'category': 1, 'difficulty': 1})
+            for i in range(3)]
+        response = self.client().post('/questions/batch', data='\n'.join(lines + ['{not json']),
+            content_type='application/x-ndjson')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['data']['inserted'], 3)
+        self.assertEqual(data['data']['errors'], [{'index': 3, 'message': 'Invalid JSON line.'}])
+
+    def test_update_and_delete_questions_batch(self):
+        added = json.loads(self.client().post('/questions', json={
+            'question': 'To be updated?', 'answer': 'Maybe', 'category': 1, 'difficulty': 1}).data)['data']
+        updated = json.loads(self.client().patch('/questions/batch', json=[{'id': added['id'], 'answer': 'Yes'}]).data)
+        deleted = json.loads(self.client().delete('/questions/batch', json={'ids': [added['id'], 'x']}).data)
+
+        self.assertEqual(updated['data']['updated'], 1)
+        self.assertEqual(Question.query.get(added['id']).answer, 'Yes')
+        self.assertEqual(deleted['data']['deleted'], 1)
+        self.assertEqual(deleted['data']['errors'], [{'index': 1, 'message': 'Question #ID must be an integer.'}])
+
+    def test_update_questions_batch_with_unknown_id(self):
+        added = json.loads(self.client().post('/questions', json={
+            'question': 'To be updated?', 'answer': 'Maybe', 'category': 1, 'difficulty': 1}).data)['data']
+        response = self.client().patch('/questions/batch', json=[
+            {'id': 999999, 'answer': 'No'}, {'id': added['id'], 'answer': 'Yes'}])
+        data = json.loads(response.data)
+
+        self.assertEqual(data['data']['updated'], 1)
+        self.assertEqual(data['data']['errors'], [{'index': 0, 'message': 'Question #ID not found.'}])
+        self.assertEqual(Question.query.get(added['id']).answer, 'Yes')
+        self.client().delete('/questions/batch', json={'ids': [added['id']]})
+
+    def test_cors_preflight_allows_patch(self):
+        response = self.client().options('/questions/batch', headers={
+            'Origin': 'http://localhost:3000', 'Access-Control-Request-Method': 'PATCH'})
+
+        self.assertIn('PATCH', response.headers['Access-Control-Allow-Methods'])
+
+    def test_add_questions_batch_with_error(self):
+        response = self.client().post('/questions/batch', json={'question': 'not a list'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_export_questions_ndjson(self):
+        response = self.client().get('/questions/export?category=1')
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertGreaterEqual(len(rows), 1)
+        self.assertTrue(all(str(row['category']) == '1' for row in rows))
+
+    def test_export_questions_csv(self):
+        response = self.client().get('/questions/export?format=csv&difficulty=1')
+        lines = response.data.decode().splitlines()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lines[0], 'id,question,answer,category,difficulty')
+        self.assertGreaterEqual(len(lines), 2)
+
+    def test_export_questions_with_error(self):
+        response = self.client().get('/questions/export?format=xml')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['message'], 'Export format must be ndjson or csv.')
+
     def test_search_question_with_result(self):
         response = self.client().post('/questions/search', json={'search_term': 'box'})
         data = json.loads(response.data)
@@ -100,6 +224,48 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertGreaterEqual(len(data['data']), 1)
     
+    def test_search_question_in_answers_with_pages(self):
+        response = self.client().post('/questions/search', json={'search_term': 'a', 'page': 2})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['data']['page'], 2)
+        self.assertLessEqual(len(data['data']['questions']), 10)
+        self.assertGreater(data['data']['total_questions'], 10)
+
+    def test_search_question_page_past_the_end(self):
+        first_page = json.loads(self.client().post('/questions/search', json={'search_term': 'a'}).data)
+        response = self.client().post('/questions/search', json={'search_term': 'a', 'page': 1000})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['data']['questions'], [])
+        self.assertEqual(data['data']['total_questions'], first_page['data']['total_questions'])
+
+    @unittest.skipUnless(os.environ.get('TRIVIA_BENCHMARK'), 'set TRIVIA_BENCHMARK=1 to run the 100k questions search benchmark')
+    def test_search_question_benchmark(self):
+        rows = [{
+            'question': 'Benchmark question number {}?'.format(i),
+            'answer': 'Benchmark answer {}'.format(i),
+            'category': '1',
+            'difficulty': 1
+        } for i in range(100000)]
+        for start in range(0, len(rows), BULK_CHUNK_SIZE):
+            bulk_insert_questions(rows[start:start + BULK_CHUNK_SIZE])
+
+        try:
+            started = time.perf_counter()
+            for _ in range(20):
+                response = self.client().post('/questions/search', json={'search_term': 'number 4242'})
+            elapsed = (time.perf_counter() - started) / 20
+            data = json.loads(response.data)
+
+            self.assertEqual(data['data']['questions'][0]['question'], 'Benchmark question number 4242?')
+            self.assertLess(elapsed, 0.2)
+        finally:
+            Question.query.filter(Question.question.like('Benchmark question number %')).delete(synchronize_session=False)
+            Question.query.session.commit()
+
     def test_search_question_with_error(self):
         response = self.client().post('/questions/search')
         data = json.loads(response.data)
@@ -118,6 +284,46 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertGreaterEqual(len(data['data']), 1)
     
+    def test_category_filters_match_integer_ids(self):
+        category_questions = json.loads(self.client().get('/categories/2/questions').data)['data']['questions']
+        exported = [json.loads(line) for line in self.client().get('/questions/export?category=2').data.splitlines()]
+
+        self.assertTrue(all(question['category'] == 2 for question in category_questions))
+        self.assertEqual(sorted(question['id'] for question in exported),
+            sorted(question['id'] for question in category_questions))
+
+    def test_migrate_question_category(self):
+        with self.app.app_context():
+            engine = Question.query.session.get_bind()
+            engine.execute('ALTER TABLE questions DROP CONSTRAINT IF EXISTS questions_category_fkey')
+            engine.execute('ALTER TABLE questions DROP CONSTRAINT IF EXISTS category')
+            engine.execute('DROP INDEX IF EXISTS ix_questions_category_id')
+            engine.execute('ALTER TABLE questions ALTER COLUMN category TYPE varchar USING category::varchar')
+            categories = dict(engine.execute('SELECT id, category FROM questions'))
+            written_ids = []
+
+            def write_while_migrating(message):
+                # rows written between the batches are kept in sync by the trigger
+                if not written_ids and message.startswith('Migrated'):
+                    written_ids.append(engine.execute(
+                        "INSERT INTO questions (question, answer, category, difficulty) "
+                        "VALUES ('Written while migrating?', 'Yes', '3', 1) RETURNING id").scalar())
+
+            migrate_question_category(batch_size=5, log=write_while_migrating)
+
+            column_type = engine.execute(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'questions' AND column_name = 'category'").scalar()
+            migrated = dict(engine.execute('SELECT id, category FROM questions'))
+            index = engine.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_questions_category_id'").scalar()
+            engine.execute('DELETE FROM questions WHERE id = %s', (written_ids[0],))
+
+        self.assertEqual(column_type, 'integer')
+        self.assertEqual({question_id: int(category) for question_id, category in categories.items()},
+            {question_id: category for question_id, category in migrated.items() if question_id in categories})
+        self.assertEqual(migrated[written_ids[0]], 3)
+        self.assertIn('(category, id)', index)
+
     def test_get__category_question_with_error(self):
         response = self.client().get('/categories/0/questions')
         data = json.loads(response.data)
@@ -148,6 +354,29 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Bad request as maybe the resource requested is not found, missing fields or wrong request.')
 
+    def test_quiz_session_with_result(self):
+        response = self.client().post('/quiz/sessions', json={'category_id': 1})
+        session = json.loads(response.data)['data']
+        played = []
+        for _ in range(session['total_questions']):
+            data = json.loads(self.client().post('/quiz/sessions/{}/next'.format(session['session_id'])).data)
+            played.append(data['data']['id'])
+        data = json.loads(self.client().post('/quiz/sessions/{}/next'.format(session['session_id'])).data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(set(played)), session['total_questions'])
+        self.assertEqual(data['success'], True)
+        self.assertIsNone(data['data'])
+
+    def test_quiz_session_with_error(self):
+        response = self.client().post('/quiz/sessions/unknown/next')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['code'], 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Quiz session is not found or has expired.')
+
     def test_not_found_route_handler(self):
         response = self.client().get('/not-found-route')
         data = json.loads(response.data)
@@ -157,6 +386,139 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Invalid endpoint or maybe HTTP request method is not support for this endpoint.')
 
+class QuizSamplingTestCase(unittest.TestCase):
+    """This class benchmarks the quiz question sampling without a database"""
+
+    def setUp(self):
+        self.ids = list(range(1, 1000001))
+
+    def test_pick_random_id_benchmark(self):
+        previous_questions = list(range(1, 1000001, 1000))
+        previous_set = set(previous_questions)
+
+        started = time.perf_counter()
+        picks = [pick_random_id(self.ids, previous_questions) for _ in range(1000)]
+        elapsed = time.perf_counter() - started
+
+        self.assertTrue(all(pick not in previous_set for pick in picks))
+        # 1M candidate ids, 1000 turns: well under a millisecond per turn.
+        self.assertLess(elapsed, 1)
+
+    def test_pick_random_id_when_mostly_played(self):
+        ids = self.ids[:100]
+
+        self.assertEqual(pick_random_id(ids, ids[1:]), 1)
+        self.assertIsNone(pick_random_id(ids, ids))
+        self.assertIsNone(pick_random_id([], []))
+
+class QuizSessionsTestCase(unittest.TestCase):
+    """This class represents the in-process quiz sessions store test case"""
+
+    def test_session_plays_every_question_once(self):
+        sessions = QuizSessions()
+        session_id = sessions.start(range(1, 101))
+
+        played = [sessions.next_id(session_id) for _ in range(100)]
+
+        self.assertEqual(sorted(played), list(range(1, 101)))
+        self.assertIsNone(sessions.next_id(session_id))
+
+    def test_sessions_are_bounded(self):
+        sessions = QuizSessions(max_sessions=2)
+        first = sessions.start([1])
+        second = sessions.start([2])
+        sessions.next_id(first)
+        sessions.start([3])
+
+        self.assertEqual(len(sessions.sessions), 2)
+        self.assertRaises(KeyError, sessions.next_id, second)
+
+    def test_sessions_expire(self):
+        sessions = QuizSessions(ttl=0)
+        session_id = sessions.start([1])
+
+        self.assertRaises(KeyError, sessions.next_id, session_id)
+
+
+class AppStartupTestCase(unittest.TestCase):
+    """This class represents the app creation test case, it needs no database"""
+
+    def test_create_app_does_no_database_io(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            app = create_app()
+        finally:
+            event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+        self.assertEqual(statements, [])
+        # the engine is only created by the first query
+        self.assertEqual(app.extensions['sqlalchemy'].connectors, {})
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """This class represents the environment driven engine configuration test case"""
+
+    def setUp(self):
+        self.environ = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def test_pool_settings_from_environment(self):
+        os.environ.update({'DB_POOL_SIZE': '2', 'DB_MAX_OVERFLOW': '0', 'DB_STATEMENT_TIMEOUT_MS': '5000'})
+
+        options = engine_options('postgres://localhost/trivia')
+
+        self.assertEqual(options['pool_size'], 2)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=5000'})
+
+    def test_pgbouncer_mode(self):
+        os.environ.update({'DB_PGBOUNCER': '1', 'DB_STATEMENT_TIMEOUT_MS': '5000'})
+
+        options = engine_options('postgres://localhost/trivia')
+
+        self.assertIs(options['poolclass'], TimedNullPool)
+        self.assertNotIn('pool_size', options)
+        self.assertNotIn('connect_args', options)
+
+    def test_sqlite_keeps_default_pool(self):
+        self.assertEqual(engine_options('sqlite://'), {})
+
+    def test_checkout_wait_excludes_connect_time(self):
+        checkouts, connects = pool_metrics['checkouts'], pool_metrics['connects']
+        wait_seconds = pool_metrics['wait_seconds']
+
+        def slow_connect():
+            time.sleep(0.05)
+            return sqlite3.connect(':memory:')
+
+        TimedNullPool(slow_connect).connect().close()
+
+        self.assertEqual(pool_metrics['checkouts'], checkouts + 1)
+        self.assertEqual(pool_metrics['connects'], connects + 1)
+        self.assertLess(pool_metrics['wait_seconds'] - wait_seconds, 0.05)
+        self.assertIn('db_pool_checkout_wait_seconds_count {}'.format(checkouts + 1), pool_metrics_text())
+        self.assertIn('db_pool_connect_seconds_count {}'.format(connects + 1), pool_metrics_text())
+
+    def test_checkout_wait_for_a_busy_pool(self):
+        wait_seconds = pool_metrics['wait_seconds']
+        pool = TimedQueuePool(lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=0, timeout=0.05)
+        connection = pool.connect()
+
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+        connection.close()
+
+        self.assertGreaterEqual(pool_metrics['wait_seconds'] - wait_seconds, 0.05)
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
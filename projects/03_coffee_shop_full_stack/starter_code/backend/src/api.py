@@ -1,10 +1,11 @@
 import os
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort
 from sqlalchemy import exc
 import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
+from .database.models import db_drop_and_create_all, setup_db, get_menu, Drink
+from .database.db_config import pool_metrics_text
 from .auth.auth import AuthError, requires_auth
 
 app = Flask(__name__)
@@ -20,23 +21,50 @@ CORS(app)
 
 ## ROUTES
 '''
-@TODO implement endpoint
-    GET /drinks
-        it should be a public endpoint
-        it should contain only the drink.short() data representation
-    returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
-        or appropriate status code indicating reason for failure
+menu_response(projection, cache_control)
+    serves the cached, already encoded menu with its ETag
+    requests sending the ETag back in If-None-Match get an empty 304
+'''
+def menu_response(projection, cache_control):
+    body, etag = get_menu(projection)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+'''
+GET /drinks
+    it is a public endpoint
+    it contains only the drink.short() data representation
+returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
+    or appropriate status code indicating reason for failure
 '''
+@app.route('/drinks')
+def get_drinks():
+    return menu_response('short', 'public, no-cache')
 
 
 '''
-@TODO implement endpoint
-    GET /drinks-detail
-        it should require the 'get:drinks-detail' permission
-        it should contain the drink.long() data representation
-    returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
-        or appropriate status code indicating reason for failure
+GET /drinks-detail
+    it requires the 'get:drinks-detail' permission
+    it contains the drink.long() data representation
+returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
+    or appropriate status code indicating reason for failure
+'''
+@app.route('/drinks-detail')
+@requires_auth('get:drinks-detail')
+def get_drinks_detail(payload):
+    return menu_response('long', 'private, no-cache')
+
+
+'''
+GET /metrics
+    the database pool metrics (connection checkout wait time) of this process
+    in the Prometheus text format
 '''
+@app.route('/metrics')
+def get_metrics():
+    return Response(pool_metrics_text(), mimetype='text/plain; version=0.0.4')
 
 
 '''
@@ -1,14 +1,23 @@
-import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+from .jwks import JWKSCache
 
 
 AUTH0_DOMAIN = 'udacity-fsnd.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'dev'
 
+# Auth0 signing keys, fetched once and refreshed in the background
+jwks_cache = JWKSCache(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json', algorithm=ALGORITHMS[0])
+
+# Max number of verified tokens kept by requires_auth
+VERIFIED_TOKENS_CACHE_SIZE = 1024
+
 ## AuthError Exception
 '''
 AuthError Exception
@@ -23,54 +32,188 @@ class AuthError(Exception):
 ## Auth Header
 
 '''
-@TODO implement get_token_auth_header() method
-    it should attempt to get the header from the request
-        it should raise an AuthError if no header is present
-    it should attempt to split bearer and the token
-        it should raise an AuthError if the header is malformed
+get_token_auth_header() method
+    it gets the header from the request
+        it raises an AuthError if no header is present
+    it splits bearer and the token
+        it raises an AuthError if the header is malformed
     return the token part of the header
 '''
 def get_token_auth_header():
-   raise Exception('Not Implemented')
+    auth = request.headers.get('Authorization', None)
+    if not auth:
+        raise AuthError({
+            'code': 'authorization_header_missing',
+            'description': 'Authorization header is expected.'
+        }, 401)
+
+    parts = auth.split()
+    if not parts or parts[0].lower() != 'bearer':
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization header must start with "Bearer".'
+        }, 401)
+
+    elif len(parts) == 1:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Token not found.'
+        }, 401)
+
+    elif len(parts) > 2:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization header must be bearer token.'
+        }, 401)
+
+    return parts[1]
 
 '''
-@TODO implement check_permissions(permission, payload) method
+check_permissions(permission, payload, permissions=None) method
     @INPUTS
         permission: string permission (i.e. 'post:drink')
         payload: decoded jwt payload
+        permissions: frozenset of the payload permissions, when already computed
 
-    it should raise an AuthError if permissions are not included in the payload
+    it raises an AuthError if permissions are not included in the payload
         !!NOTE check your RBAC settings in Auth0
-    it should raise an AuthError if the requested permission string is not in the payload permissions array
+    it raises an AuthError if the requested permission string is not in the payload permissions array
     return true otherwise
 '''
-def check_permissions(permission, payload):
-    raise Exception('Not Implemented')
+def check_permissions(permission, payload, permissions=None):
+    if permissions is None:
+        if 'permissions' not in payload:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions not included in JWT.'
+            }, 400)
+        permissions = frozenset(payload['permissions'])
+
+    if permission and permission not in permissions:
+        raise AuthError({
+            'code': 'unauthorized',
+            'description': 'Permission not found.'
+        }, 403)
+
+    return True
 
 '''
-@TODO implement verify_decode_jwt(token) method
+verify_decode_jwt(token) method
     @INPUTS
         token: a json web token (string)
 
     it should be an Auth0 token with key id (kid)
-    it should verify the token using Auth0 /.well-known/jwks.json
-    it should decode the payload from the token
-    it should validate the claims
+    it verifies the token using the Auth0 /.well-known/jwks.json keys (cached by jwks_cache)
+        it raises an AuthError (503) if the keys can't be fetched
+    it decodes the payload from the token
+    it validates the claims
     return the decoded payload
 
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 def verify_decode_jwt(token):
-    raise Exception('Not Implemented')
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.JWTError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization malformed.'
+        }, 401)
+    if 'kid' not in unverified_header:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization malformed.'
+        }, 401)
+
+    try:
+        rsa_key = jwks_cache.get_key(unverified_header['kid'])
+    except Exception:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
+    if rsa_key:
+        try:
+            payload = jwt.decode(
+                token,
+                rsa_key,
+                algorithms=ALGORITHMS,
+                audience=API_AUDIENCE,
+                issuer='https://' + AUTH0_DOMAIN + '/'
+            )
+
+            return payload
+
+        except jwt.ExpiredSignatureError:
+            raise AuthError({
+                'code': 'token_expired',
+                'description': 'Token expired.'
+            }, 401)
+
+        except jwt.JWTClaimsError:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Incorrect claims. Please, check the audience and issuer.'
+            }, 401)
+        except Exception:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to parse authentication token.'
+            }, 400)
+    raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to find the appropriate key.'
+            }, 400)
+
+'''
+Verified tokens cache
+    clients resend the same bearer token on every request, so the payload of
+    each verified token is kept (keyed by the token sha256 digest) together with
+    a frozenset of its permissions until the token exp claim, evicting the least
+    recently used tokens past VERIFIED_TOKENS_CACHE_SIZE.
+'''
+verified_tokens = OrderedDict()
+verified_tokens_lock = threading.Lock()
+
+def get_verified_token(token):
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    with verified_tokens_lock:
+        entry = verified_tokens.get(digest)
+        if entry is not None:
+            if entry['exp'] > time.time():
+                verified_tokens.move_to_end(digest)
+                return entry['payload'], entry['permissions']
+            del verified_tokens[digest]
+
+    payload = verify_decode_jwt(token)
+    if 'permissions' not in payload:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Permissions not included in JWT.'
+        }, 400)
+    permissions = frozenset(payload['permissions'])
+
+    # Tokens without an expiry are verified on every request.
+    if 'exp' in payload:
+        with verified_tokens_lock:
+            verified_tokens[digest] = {
+                'payload': payload,
+                'permissions': permissions,
+                'exp': payload['exp']
+            }
+            while len(verified_tokens) > VERIFIED_TOKENS_CACHE_SIZE:
+                verified_tokens.popitem(last=False)
+
+    return payload, permissions
 
 '''
-@TODO implement @requires_auth(permission) decorator method
+@requires_auth(permission) decorator method
     @INPUTS
         permission: string permission (i.e. 'post:drink')
 
-    it should use the get_token_auth_header method to get the token
-    it should use the verify_decode_jwt method to decode the jwt
-    it should use the check_permissions method validate claims and check the requested permission
+    it uses the get_token_auth_header method to get the token
+    it uses the verify_decode_jwt method (through the verified tokens cache) to decode the jwt
+    it uses the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
 '''
 def requires_auth(permission=''):
@@ -78,9 +221,9 @@ def requires_auth(permission=''):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            payload, permissions = get_verified_token(token)
+            check_permissions(permission, payload, permissions)
             return f(payload, *args, **kwargs)
 
         return wrapper
-    return requires_auth_decorator
\ No newline at end of file
+    return requires_auth_decorator
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from sqlalchemy.pool import NullPool, QueuePool
+
+'''
+Database engine configuration from the DB_* environment variables
+    a copy of projects/02_trivia_api/starter/backend/db_config.py, where the
+    variables are documented, kept here so the project deploys on its own
+'''
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def env_flag(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+'''
+Pool metrics
+    time spent waiting for a free connection in the pool, and time spent
+    opening new connections (pool overflow, or every checkout in PgBouncer
+    mode), summed per process. The wait excludes the connect time.
+'''
+pool_metrics = {
+    'checkouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+    'connects': 0, 'connect_seconds': 0.0, 'max_connect_seconds': 0.0,
+}
+pool_metrics_lock = threading.Lock()
+checkout_connect_seconds = threading.local()
+
+def record_checkout_wait(seconds):
+    with pool_metrics_lock:
+        pool_metrics['checkouts'] += 1
+        pool_metrics['wait_seconds'] += seconds
+        pool_metrics['max_wait_seconds'] = max(pool_metrics['max_wait_seconds'], seconds)
+
+def record_connect(seconds):
+    with pool_metrics_lock:
+        pool_metrics['connects'] += 1
+        pool_metrics['connect_seconds'] += seconds
+        pool_metrics['max_connect_seconds'] = max(pool_metrics['max_connect_seconds'], seconds)
+
+class TimedPoolMixin:
+    def _create_connection(self):
+        started = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            seconds = time.perf_counter() - started
+            checkout_connect_seconds.value = getattr(checkout_connect_seconds, 'value', 0.0) + seconds
+            record_connect(seconds)
+
+    def _do_get(self):
+        checkout_connect_seconds.value = 0.0
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            record_checkout_wait(max(time.perf_counter() - started - checkout_connect_seconds.value, 0.0))
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    pass
+
+'''
+engine_options(database_url)
+    SQLALCHEMY_ENGINE_OPTIONS for the database url. SQLite keeps its default
+    pool, none of the settings apply to it.
+'''
+def engine_options(database_url):
+    if database_url.startswith('sqlite'):
+        return {}
+
+    if env_flag('DB_PGBOUNCER', False):
+        return {
+            'poolclass': TimedNullPool,
+            'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True),
+        }
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': env_int('DB_POOL_SIZE', 5),
+        'max_overflow': env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True),
+    }
+    statement_timeout = env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if statement_timeout and database_url.startswith('postgres'):
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(statement_timeout)}
+    return options
+
+'''
+pool_metrics_text()
+    the pool metrics in the Prometheus text format
+'''
+def pool_metrics_text():
+    with pool_metrics_lock:
+        metrics = dict(pool_metrics)
+    return (
+        '# HELP db_pool_checkout_wait_seconds Time spent waiting for a free pooled connection.\n'
+        '# TYPE db_pool_checkout_wait_seconds summary\n'
+        'db_pool_checkout_wait_seconds_count {checkouts}\n'
+        'db_pool_checkout_wait_seconds_sum {wait_seconds:.6f}\n'
+        '# HELP db_pool_checkout_wait_seconds_max Longest wait for a free pooled connection.\n'
+        '# TYPE db_pool_checkout_wait_seconds_max gauge\n'
+        'db_pool_checkout_wait_seconds_max {max_wait_seconds:.6f}\n'
+        '# HELP db_pool_connect_seconds Time spent opening new database connections.\n'
+        '# TYPE db_pool_connect_seconds summary\n'
+        'db_pool_connect_seconds_count {connects}\n'
+        'db_pool_connect_seconds_sum {connect_seconds:.6f}\n'
+        '# HELP db_pool_connect_seconds_max Longest time spent opening a database connection.\n'
+        '# TYPE db_pool_connect_seconds_max gauge\n'
+        'db_pool_connect_seconds_max {max_connect_seconds:.6f}\n'
+    ).format(**metrics)
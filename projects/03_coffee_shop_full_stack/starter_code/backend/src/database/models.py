@@ -1,11 +1,15 @@
 import os
-from sqlalchemy import Column, String, Integer
+import time
+import hashlib
+from sqlalchemy import Column, String, Integer, event
 from flask_sqlalchemy import SQLAlchemy
 import json
+from .db_config import engine_options
 
 database_filename = "database.db"
 project_dir = os.path.dirname(os.path.abspath(__file__))
-database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filename))
+# DATABASE_URL points the app to another database (e.g. Postgres in production)
+database_path = os.environ.get('DATABASE_URL', "sqlite:///{}".format(os.path.join(project_dir, database_filename)))
 
 db = SQLAlchemy()
 
@@ -16,6 +20,7 @@ setup_db(app)
 def setup_db(app):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
 
@@ -29,6 +34,46 @@ def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
 
+'''
+Menu cache
+    the whole menu encoded once as json bytes per projection ('short' or 'long')
+    together with its ETag, kept per process
+    it's dropped by Drink.insert(), update() and delete(), and refreshed after
+    MENU_CACHE_TTL seconds to pick up changes made by other workers
+'''
+MENU_CACHE_TTL = 60
+menu_cache = {'version': 0, 'menus': {}}
+
+'''
+get_menu(projection)
+    returns (body, etag) of {"success": True, "drinks": [...]} for the projection
+'''
+def get_menu(projection):
+    entry = menu_cache['menus'].get(projection)
+    if entry is not None and entry['expires_at'] > time.monotonic():
+        return entry['body'], entry['etag']
+
+    version = menu_cache['version']
+    drinks = [getattr(drink, projection)() for drink in Drink.query.order_by(Drink.id).all()]
+    body = json.dumps({
+        'success': True,
+        'drinks': drinks
+    }).encode()
+    etag = hashlib.sha1(body).hexdigest()
+
+    # A write that happened while the menu was being built invalidated it already.
+    if version == menu_cache['version']:
+        menu_cache['menus'][projection] = {
+            'body': body,
+            'etag': etag,
+            'expires_at': time.monotonic() + MENU_CACHE_TTL
+        }
+    return body, etag
+
+def invalidate_menu_cache():
+    menu_cache['version'] += 1
+    menu_cache['menus'] = {}
+
 '''
 Drink
 a persistent drink entity, extends the base SQLAlchemy Model
@@ -42,28 +87,49 @@ class Drink(db.Model):
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
     recipe =  Column(String(180), nullable=False)
 
+    '''
+    cached(name, build)
+        returns the cached value name of this instance, building it once
+        the cached values are reset whenever the row changes (see clear_drink_cache)
+    '''
+    def cached(self, name, build):
+        cache = self.__dict__.get('_cached')
+        if cache is None:
+            cache = self.__dict__['_cached'] = {}
+        if name not in cache:
+            cache[name] = build()
+        return cache[name]
+
+    '''
+    parsed_recipe
+        the recipe json blob decoded once per loaded row
+    '''
+    @property
+    def parsed_recipe(self):
+        return self.cached('recipe', lambda: json.loads(self.recipe))
+
     '''
     short()
         short form representation of the Drink model
+        built from the cached recipe, so callers get their own copy
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': short_recipe
+            'recipe': [{'color': r['color'], 'parts': r['parts']} for r in self.parsed_recipe]
         }
 
     '''
     long()
         long form representation of the Drink model
+        built from the cached recipe, so callers get their own copy
     '''
     def long(self):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': [dict(r) for r in self.parsed_recipe]
         }
 
     '''
@@ -78,6 +144,7 @@ class Drink(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        invalidate_menu_cache()
 
     '''
     delete()
@@ -90,6 +157,7 @@ class Drink(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        invalidate_menu_cache()
 
     '''
     update()
@@ -102,6 +170,21 @@ class Drink(db.Model):
     '''
     def update(self):
         db.session.commit()
+        invalidate_menu_cache()
 
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps(self.short())
+
+'''
+clear_drink_cache
+    drops the cached recipe of a drink when one of its columns is
+    assigned, or when the row is expired or refreshed from the database
+'''
+@event.listens_for(Drink.id, 'set')
+@event.listens_for(Drink.title, 'set')
+@event.listens_for(Drink.recipe, 'set')
+def clear_drink_cache(target, *args):
+    target.__dict__.pop('_cached', None)
+
+event.listen(Drink, 'expire', clear_drink_cache)
+event.listen(Drink, 'refresh', clear_drink_cache)
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import unittest
+
+from src.api import app
+from src.database.models import db, invalidate_menu_cache, Drink
+
+
+class CoffeeShopTestCase(unittest.TestCase):
+    """This class represents the coffee shop menu test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.client = app.test_client
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        invalidate_menu_cache()
+
+        for i in range(50):
+            Drink(title='Drink %d' % i, recipe=json.dumps([
+                {'name': 'water', 'color': 'blue', 'parts': 1},
+                {'name': 'coffee', 'color': 'brown', 'parts': i + 1}
+            ])).insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_get_drinks(self):
+        response = self.client().get('/drinks')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['drinks']), 50)
+        self.assertEqual(data['drinks'][0]['recipe'][0], {'color': 'blue', 'parts': 1})
+
+    def test_get_drinks_not_modified(self):
+        response = self.client().get('/drinks')
+        cached_response = self.client().get('/drinks', headers={'If-None-Match': response.headers['ETag']})
+
+        self.assertEqual(cached_response.status_code, 304)
+        self.assertEqual(cached_response.data, b'')
+
+    def test_get_drinks_after_insert(self):
+        response = self.client().get('/drinks')
+        Drink(title='Espresso', recipe=json.dumps([{'name': 'coffee', 'color': 'brown', 'parts': 1}])).insert()
+        new_response = self.client().get('/drinks', headers={'If-None-Match': response.headers['ETag']})
+
+        self.assertEqual(new_response.status_code, 200)
+        self.assertEqual(len(json.loads(new_response.data)['drinks']), 51)
+
+    def test_drink_recipe_cache_is_cleared_on_assignment(self):
+        drink = Drink.query.first()
+        drink.long()
+        drink.recipe = json.dumps([{'name': 'milk', 'color': 'white', 'parts': 2}])
+
+        self.assertEqual(drink.long()['recipe'], [{'name': 'milk', 'color': 'white', 'parts': 2}])
+        self.assertEqual(drink.short()['recipe'], [{'color': 'white', 'parts': 2}])
+
+    def test_drink_recipe_cache_is_cleared_on_expire(self):
+        drink = Drink.query.first()
+        drink.short()
+        db.session.query(Drink).filter(Drink.id == drink.id).update(
+            {'recipe': json.dumps([{'name': 'tea', 'color': 'green', 'parts': 3}])}, synchronize_session=False)
+        db.session.commit()
+
+        self.assertEqual(drink.short()['recipe'], [{'color': 'green', 'parts': 3}])
+        self.assertEqual(drink.long()['recipe'], [{'name': 'tea', 'color': 'green', 'parts': 3}])
+
+    def test_drink_projections_are_copies(self):
+        drink = Drink.query.first()
+        drink.long()['recipe'][0]['parts'] = 100
+        drink.long()['recipe'].append({'name': 'sugar', 'color': 'white', 'parts': 1})
+        drink.short()['recipe'].clear()
+
+        self.assertEqual(drink.long()['recipe'][0], {'name': 'water', 'color': 'blue', 'parts': 1})
+        self.assertEqual(len(drink.long()['recipe']), 2)
+        self.assertEqual(len(drink.short()['recipe']), 2)
+
+    def test_get_metrics(self):
+        response = self.client().get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'db_pool_checkout_wait_seconds_count', response.data)
+
+    @unittest.skipUnless(os.environ.get('COFFEE_SHOP_BENCHMARK'), 'set COFFEE_SHOP_BENCHMARK=1 to run the GET /drinks load test')
+    def test_get_drinks_load(self):
+        requests = 300
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            invalidate_menu_cache()
+            self.client().get('/drinks')
+        uncached_throughput = requests / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            self.client().get('/drinks')
+        cached_throughput = requests / (time.perf_counter() - started)
+
+        self.assertGreater(cached_throughput, uncached_throughput)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
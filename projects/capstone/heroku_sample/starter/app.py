@@ -1,6 +1,8 @@
 import os
-from flask import Flask
-from models import setup_db
+from flask import Flask, Response
+from flask_cors import CORS
+from models import setup_db, db_create_all
+from db_config import pool_metrics_text
 
 def create_app(test_config=None):
 
@@ -19,6 +21,14 @@ def create_app(test_config=None):
     def be_cool():
         return "Be cool, man, be coooool! You're almost a FSND grad!"
 
+    @app.route('/metrics')
+    def get_metrics():
+        return Response(pool_metrics_text(), mimetype='text/plain; version=0.0.4')
+
+    @app.cli.command('init-db')
+    def init_db():
+        db_create_all()
+
     return app
 
 app = create_app()
@@ -1,6 +1,8 @@
-from sqlalchemy import Column, String, create_engine
+import os
+from sqlalchemy import Column, String, Integer, create_engine
 from flask_sqlalchemy import SQLAlchemy
 import json
+from db_config import engine_options
 
 database_path = os.environ['DATABASE_URL']
 
@@ -13,8 +15,16 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
+
+'''
+db_create_all()
+    creates the missing tables, run it with flask init-db
+    (setup_db doesn't, so starting a worker does no database I/O)
+'''
+def db_create_all():
     db.create_all()
 
 